@@ -0,0 +1,301 @@
+#Adaptive sampling of a Function over a rectangle.  The rectangle is split
+#as a quadtree: a cell is split into four while the bilinear interpolation
+#of its corners misses the function at the cell center or an edge midpoint
+#by more than the tolerance.  Flat regions end up with a few large cells
+#and steep ones with small cells.  The tree is then balanced so that
+#neighbouring leaves differ in size by at most a factor of two, which lets
+#contours pass from a large cell to its smaller neighbours through the
+#same points.  Points lie on a lattice of
+#2^maxDepth + 1 points per side and every point is evaluated once, so the
+#evaluation count can be compared with a dense grid of the same lattice.
+#  sampler = AdaptiveSampler(Function("z=1/(x^2+y^2+0.01)"), -1, 1, -1, 1)
+#  print(sampler.getEvaluations(), sampler.getGridPoints())
+#  lines = sampler.getContours(10.0)
+import math
+from function_parser import numpy
+
+DEFAULT_TOLERANCE = 1e-3
+DEFAULT_MAX_DEPTH = 8
+DEFAULT_MIN_DEPTH = 2
+
+#Corners of a cell (i, j, size) in lattice units, counter-clockwise
+#from the lower left
+def cellCorners(cell):
+    i, j, size = cell
+    return [(i, j), (i + size, j), (i + size, j + size), (i, j + size)]
+
+#Center and edge midpoints of a cell: bottom, right, top, left
+def cellMidpoints(cell):
+    i, j, size = cell
+    half = size // 2
+    return [(i + half, j + half), (i + half, j), (i + size, j + half),
+        (i + half, j + size), (i, j + half)]
+
+def cellChildren(cell):
+    i, j, size = cell
+    half = size // 2
+    return [(i, j, half), (i + half, j, half), (i + half, j + half, half), (i, j + half, half)]
+
+#Point where the level crosses the edge from a to b, with a and b in a
+#fixed order so neighbouring cells get the same point.  Large cells cross
+#at the points of their smaller neighbours, see AdaptiveSampler.__outline
+def edgeCrossing(a, za, b, zb, level):
+    if b < a:
+        a, za, b, zb = b, zb, a, za
+    t = (level - za) / (zb - za)
+    return (a[0] + t * (b[0] - a[0]), a[1] + t * (b[1] - a[1]))
+
+#Join segments that share end points into polylines.  Returns a list of
+#point lists; a closed contour repeats its first point at the end
+def joinSegments(segments):
+    ends = {}
+    for index, (a, b) in enumerate(segments):
+        ends.setdefault(a, []).append(index)
+        ends.setdefault(b, []).append(index)
+    used = [False] * len(segments)
+
+    #Follow unused segments from point until the line ends
+    def follow(line, point):
+        while True:
+            nextIndex = None
+            for index in ends[point]:
+                if not used[index]:
+                    nextIndex = index
+                    break
+            if nextIndex is None:
+                return
+            used[nextIndex] = True
+            a, b = segments[nextIndex]
+            point = b if a == point else a
+            line.append(point)
+
+    lines = []
+    #Start at open ends first so open lines come out whole
+    starts = [point for point, indexes in ends.items() if len(indexes) == 1]
+    starts += [segment[0] for segment in segments]
+    for start in starts:
+        if all(used[index] for index in ends[start]):
+            continue
+        line = [start]
+        follow(line, start)
+        lines.append(line)
+    return lines
+
+class AdaptiveSampler:
+    def __init__(self, function, x0, x1, y0, y1, tolerance = DEFAULT_TOLERANCE,
+            maxDepth = DEFAULT_MAX_DEPTH, minDepth = DEFAULT_MIN_DEPTH):
+        self.__function = function
+        self.__x0 = float(x0)
+        self.__y0 = float(y0)
+        self.__size = 2 ** maxDepth
+        self.__dx = (float(x1) - self.__x0) / self.__size
+        self.__dy = (float(y1) - self.__y0) / self.__size
+        self.__tolerance = tolerance
+        self.__values = {}
+        self.__split = set()
+        self.__leaves = []
+        self.__refine(min(minDepth, maxDepth))
+        self.__balance()
+
+    #Coordinates of a lattice point
+    def toPoint(self, point):
+        return (self.__x0 + point[0] * self.__dx, self.__y0 + point[1] * self.__dy)
+
+    #Evaluate every lattice point that is not known yet, in one batch
+    #when numpy is there.  Points where the function is not a real
+    #number get nan
+    def __evaluate(self, points):
+        points = [point for point in dict.fromkeys(points) if point not in self.__values]
+        if len(points) == 0:
+            return
+        coords = [self.toPoint(point) for point in points]
+        if numpy is not None:
+            xs = numpy.array([coord[0] for coord in coords])
+            ys = numpy.array([coord[1] for coord in coords])
+            results = self.__function.evalArray(xs, ys).tolist()
+        else:
+            results = []
+            for x, y in coords:
+                try:
+                    value = self.__function.eval(x, y)
+                except (ArithmeticError, ValueError):
+                    value = math.nan
+                if type(value) == complex:
+                    value = math.nan
+                results.append(float(value))
+        for point, value in zip(points, results):
+            self.__values[point] = value
+
+    #Does the cell have to be split?  Its corners and midpoints are known
+    def __needsSplit(self, cell):
+        values = self.__values
+        a, b, c, d = [values[point] for point in cellCorners(cell)]
+        mids = [values[point] for point in cellMidpoints(cell)]
+        corners = [a, b, c, d]
+        finite = [math.isfinite(value) for value in corners + mids]
+        if not all(finite):
+            #Refine the border of regions where the function is not finite
+            return any(finite)
+        guesses = [(a + b + c + d) / 4, (a + b) / 2, (b + c) / 2, (c + d) / 2, (d + a) / 2]
+        error = max(abs(mid - guess) for mid, guess in zip(mids, guesses))
+        return error > self.__tolerance
+
+    #Split cells breadth first, one batch of evaluations per level.
+    #Cells above minDepth levels are always split
+    def __refine(self, minDepth):
+        cells = [(0, 0, self.__size)]
+        depth = 0
+        while len(cells) > 0:
+            points = []
+            for cell in cells:
+                points += cellCorners(cell)
+                if cell[2] > 1:
+                    points += cellMidpoints(cell)
+            self.__evaluate(points)
+            nextCells = []
+            for cell in cells:
+                if cell[2] > 1 and (depth < minDepth or self.__needsSplit(cell)):
+                    self.__split.add(cell)
+                    nextCells += cellChildren(cell)
+                else:
+                    self.__leaves.append(cell)
+            cells = nextCells
+            depth += 1
+
+    #Is a neighbour of the leaf split into cells less than half its size?
+    #Those are the split children of a same size neighbour that touch it
+    def __tooCoarse(self, cell):
+        i, j, size = cell
+        half = size // 2
+        touching = [(i - half, j, half), (i - half, j + half, half),
+            (i + size, j, half), (i + size, j + half, half),
+            (i, j - half, half), (i + half, j - half, half),
+            (i, j + size, half), (i + half, j + size, half)]
+        return any(child in self.__split for child in touching)
+
+    #Split leaves until no leaf has a neighbour less than half its size,
+    #one batch of evaluations per round, so an edge of a leaf holds at
+    #most one corner of its neighbours
+    def __balance(self):
+        while True:
+            coarse = [cell for cell in self.__leaves if self.__tooCoarse(cell)]
+            if len(coarse) == 0:
+                return
+            points = []
+            for cell in coarse:
+                points += cellMidpoints(cell)
+            self.__evaluate(points)
+            splitNow = set(coarse)
+            leaves = [cell for cell in self.__leaves if cell not in splitNow]
+            for cell in coarse:
+                self.__split.add(cell)
+                leaves += cellChildren(cell)
+            self.__leaves = leaves
+
+    #Number of times the function was evaluated
+    def getEvaluations(self):
+        return len(self.__values)
+
+    #Number of points of a dense grid with the same resolution
+    def getGridPoints(self):
+        return (self.__size + 1) ** 2
+
+    #Leaf cells as (i, j, size) in lattice units
+    def getLeaves(self):
+        return self.__leaves
+
+    #Leaf cell that holds the point (x, y)
+    def findLeaf(self, x, y):
+        i = min(max((x - self.__x0) / self.__dx, 0), self.__size)
+        j = min(max((y - self.__y0) / self.__dy, 0), self.__size)
+        cell = (0, 0, self.__size)
+        while cell in self.__split:
+            half = cell[2] // 2
+            right = i >= cell[0] + half
+            top = j >= cell[1] + half
+            cell = (cell[0] + half * right, cell[1] + half * top, half)
+        return cell
+
+    #Bilinear interpolation of the samples at (x, y)
+    def interpolate(self, x, y):
+        cell = self.findLeaf(x, y)
+        a, b, c, d = [self.__values[point] for point in cellCorners(cell)]
+        u = ((x - self.__x0) / self.__dx - cell[0]) / cell[2]
+        v = ((y - self.__y0) / self.__dy - cell[1]) / cell[2]
+        return (a * (1 - u) + b * u) * (1 - v) + (d * (1 - u) + c * u) * v
+
+    #Mesh of the leaf cells as (vertices, quads).  vertices are (x, y, z)
+    #and every quad lists the indexes of its corners counter-clockwise.
+    #Neighbours of different sizes meet at T-junctions
+    def getMesh(self):
+        indexes = {}
+        vertices = []
+        quads = []
+        for cell in self.__leaves:
+            quad = []
+            for point in cellCorners(cell):
+                if point not in indexes:
+                    indexes[point] = len(vertices)
+                    x, y = self.toPoint(point)
+                    vertices.append((x, y, self.__values[point]))
+                quad.append(indexes[point])
+            quads.append(quad)
+        return (vertices, quads)
+
+    #Write the mesh to a text stream as a Wavefront OBJ file
+    def writeObj(self, stream):
+        vertices, quads = self.getMesh()
+        for x, y, z in vertices:
+            stream.write("v %.17g %.17g %.17g\n" % (x, y, z))
+        for quad in quads:
+            stream.write("f %d %d %d %d\n" % tuple(index + 1 for index in quad))
+
+    #Lattice points around a leaf, counter-clockwise from the lower left:
+    #its corners and the midpoints of the edges shared with smaller
+    #neighbours, where those neighbours have a corner
+    def __outline(self, cell):
+        i, j, size = cell
+        corners = cellCorners(cell)
+        mids = cellMidpoints(cell)[1:]
+        neighbours = [(i, j - size, size), (i + size, j, size), (i, j + size, size), (i - size, j, size)]
+        points = []
+        for k in range(4):
+            points.append(corners[k])
+            if neighbours[k] in self.__split:
+                points.append(mids[k])
+        return points
+
+    #Line segments ((x, y), (x, y)) where the function crosses level, by
+    #marching squares over the outlines of the leaf cells, so a contour
+    #leaves a cell at the same point it enters its neighbour.  Between two
+    #crossings the outline is above or below the level; the crossings are
+    #paired around the stretches on the other side than the cell center,
+    #taken as the mean of the corners, which resolves saddles.  Cells with
+    #a point that is not finite are skipped
+    def getContourSegments(self, level):
+        segments = []
+        for cell in self.__leaves:
+            points = self.__outline(cell)
+            values = [self.__values[point] for point in points]
+            if not all(math.isfinite(value) for value in values):
+                continue
+            count = len(points)
+            above = [value >= level for value in values]
+            crossings = [k for k in range(count) if above[k] != above[(k + 1) % count]]
+            if len(crossings) == 0:
+                continue
+            centerAbove = sum(self.__values[point] for point in cellCorners(cell)) / 4 >= level
+            ends = []
+            for k in crossings:
+                a = points[k]
+                b = points[(k + 1) % count]
+                ends.append(self.toPoint(edgeCrossing(a, self.__values[a], b, self.__values[b], level)))
+            #Crossing m starts the stretch of outline point crossings[m] + 1
+            first = 0 if above[(crossings[0] + 1) % count] != centerAbove else 1
+            for m in range(first, len(crossings), 2):
+                segments.append((ends[m], ends[(m + 1) % len(crossings)]))
+        return segments
+
+    #Contour lines of level as polylines of (x, y) points
+    def getContours(self, level):
+        return joinSegments(self.getContourSegments(level))
@@ -0,0 +1,190 @@
+#Benchmark suite for the function parser.  Every stage is timed on seeded
+#random expressions: lexing (tokens/s), parsing, optimizing and compiling
+#(nodes/s) and each evaluation path (points/s).  Results can be saved as
+#JSON and compared against an earlier run to catch regressions.
+#  python function_bench.py --output new.json --compare old.json
+import argparse
+import json
+import platform
+import random
+import sys
+import time
+from function_parser import Function, Lexer, Node, Parser, countNodes, formatNode, numpy
+from function_optimizer import Optimizer
+from function_compiler import Compiler
+from function_rpn import compileProgram
+
+#Relative weight of each operator in generated expressions
+DEFAULT_MIX = {'+' : 3, '-' : 2, '*' : 3, '/' : 1, '^' : 1}
+
+DEFAULT_SIZES = [10, 100, 1000]
+DEFAULT_DEPTH = 64
+DEFAULT_POINTS = 2000
+DEFAULT_REPEAT = 5
+DEFAULT_TOLERANCE = 0.1
+
+#Random leaf: a variable, an int or a float
+def randomLeaf(rand):
+    kind = rand.random()
+    if kind < 0.5:
+        return Node(rand.choice(['x', 'y']))
+    elif kind < 0.75:
+        return Node(rand.randint(1, 9))
+    return Node(round(rand.uniform(0.5, 9.5), 2))
+
+#Seeded random expression with size leaves, tree depth at most depth and
+#operators drawn with the weights in mix.  '^' always gets a small integer
+#exponent so values stay finite.  Returns the "z=..." source string
+def randomExpression(size, depth = DEFAULT_DEPTH, mix = DEFAULT_MIX, seed = 0):
+    if size > 2 ** max(depth - 1, 0):
+        raise ValueError("a tree of depth " + str(depth) + " cannot hold " + str(size) + " leaves")
+    rand = random.Random(seed)
+    operators = list(mix.keys())
+    weights = [mix[op] for op in operators]
+    items = [(randomLeaf(rand), 1) for i in range(size)]
+    while len(items) > 1:
+        i = rand.randrange(len(items) - 1)
+        op = rand.choices(operators, weights)[0]
+        extra = 2 if op == '^' else 1
+        if max(items[i][1], items[i + 1][1]) + extra > depth:
+            #Combine the shallowest neighbours instead to stay within depth
+            i = min(range(len(items) - 1), key = lambda j: max(items[j][1], items[j + 1][1]))
+            op = rand.choice([op for op in operators if op != '^'] or ['*'])
+            extra = 1
+        (left, leftDepth), (right, rightDepth) = items[i], items[i + 1]
+        if op == '^':
+            left = Node('^', left, Node(rand.randint(2, 3)))
+            op = '*'
+        items[i:i + 2] = [(Node(op, left, right), max(leftDepth, rightDepth) + extra)]
+    return "z=" + formatNode(items[0][0])
+
+#Best rate of count / seconds for calling run repeat times
+def bestRate(run, count, repeat = DEFAULT_REPEAT):
+    best = 0.0
+    for i in range(repeat):
+        start = time.perf_counter()
+        run()
+        elapsed = time.perf_counter() - start
+        if elapsed > 0:
+            best = max(best, count / elapsed)
+    return best
+
+#Tokenize the expression and return tokens per second
+def benchLexer(source, repeat = DEFAULT_REPEAT):
+    count = len(Lexer(source + "$").getTokens())
+    return bestRate(lambda: Lexer(source + "$").getTokens(), count, repeat)
+
+#Measure every stage for one expression.  Returns a dict of rates
+def benchExpression(source, points = DEFAULT_POINTS, repeat = DEFAULT_REPEAT, seed = 0):
+    rand = random.Random(seed)
+    xs = [rand.uniform(0.5, 2.0) for i in range(points)]
+    ys = [rand.uniform(0.5, 2.0) for i in range(points)]
+    parsed = Parser(source).getRoot()
+    parsedNodes = countNodes(parsed)
+    optimized = Optimizer(parsed).getRoot()
+    nodes = countNodes(optimized)
+    interpreted = Function(source)
+    compiled = Function(source)
+    compiled.compile()
+    program = compileProgram(optimized)
+
+    def scalar(function):
+        def run():
+            for x, y in zip(xs, ys):
+                function.eval(x, y)
+        return run
+
+    results = {
+        'nodes' : parsedNodes,
+        'lexTokensPerSecond' : benchLexer(source, repeat),
+        'parseNodesPerSecond' : bestRate(lambda: Parser(source).getRoot(), parsedNodes, repeat),
+        'optimizeNodesPerSecond' : bestRate(lambda: Optimizer(parsed), parsedNodes, repeat),
+        'compileNodesPerSecond' : bestRate(lambda: Compiler(optimized).getKernel(), nodes, repeat),
+        'scalarPointsPerSecond' : bestRate(scalar(interpreted), points, repeat),
+        'compiledPointsPerSecond' : bestRate(scalar(compiled), points, repeat),
+        'rpnPointsPerSecond' : bestRate(scalar(program), points, repeat)
+    }
+    if numpy is not None:
+        xArr = numpy.array(xs)
+        yArr = numpy.array(ys)
+        results['batchPointsPerSecond'] = bestRate(lambda: interpreted.evalArray(xArr, yArr), points, repeat)
+        results['compiledBatchPointsPerSecond'] = bestRate(lambda: compiled.evalArray(xArr, yArr), points, repeat)
+        results['rpnBatchPointsPerSecond'] = bestRate(lambda: program.evalArray(xArr, yArr), points, repeat)
+    return results
+
+#Run the suite for expressions of every size.  Returns the JSON document
+def runSuite(sizes = DEFAULT_SIZES, depth = DEFAULT_DEPTH, mix = DEFAULT_MIX,
+        points = DEFAULT_POINTS, repeat = DEFAULT_REPEAT, seed = 0):
+    results = {}
+    for size in sizes:
+        source = randomExpression(size, depth, mix, seed)
+        results[str(size)] = benchExpression(source, points, repeat, seed)
+    return {
+        'meta' : {
+            'python' : platform.python_version(),
+            'numpy' : numpy.__version__ if numpy is not None else None,
+            'platform' : platform.platform(),
+            'sizes' : sizes,
+            'depth' : depth,
+            'mix' : mix,
+            'points' : points,
+            'repeat' : repeat,
+            'seed' : seed
+        },
+        'results' : results
+    }
+
+#Rates in current that dropped by more than tolerance against baseline.
+#Returns a list of (size, metric, baseline rate, current rate)
+def findRegressions(baseline, current, tolerance = DEFAULT_TOLERANCE):
+    regressions = []
+    for size, metrics in current['results'].items():
+        before = baseline['results'].get(size, {})
+        for metric, rate in metrics.items():
+            if not metric.endswith('PerSecond') or metric not in before:
+                continue
+            if rate < before[metric] * (1.0 - tolerance):
+                regressions.append((size, metric, before[metric], rate))
+    return regressions
+
+#Print the results as a table, one row per size
+def printResults(document, stream = sys.stdout):
+    for size, metrics in document['results'].items():
+        stream.write("size %s (%d nodes)\n" % (size, metrics['nodes']))
+        for metric, rate in metrics.items():
+            if metric.endswith('PerSecond'):
+                stream.write("  %-30s %14.0f\n" % (metric, rate))
+
+def main(args = None):
+    argParser = argparse.ArgumentParser(description = "Benchmark lexing, parsing and evaluation")
+    argParser.add_argument('--sizes', default = ",".join(str(size) for size in DEFAULT_SIZES),
+        help = "comma separated leaf counts of the generated expressions")
+    argParser.add_argument('--depth', type = int, default = DEFAULT_DEPTH, help = "maximum tree depth")
+    argParser.add_argument('--mix', default = None, help = "operator weights as JSON, e.g. '{\"+\": 1, \"*\": 2}'")
+    argParser.add_argument('--points', type = int, default = DEFAULT_POINTS, help = "points per evaluation run")
+    argParser.add_argument('--repeat', type = int, default = DEFAULT_REPEAT, help = "runs per measurement, best is kept")
+    argParser.add_argument('--seed', type = int, default = 0, help = "random seed")
+    argParser.add_argument('--output', default = None, help = "write results to this JSON file")
+    argParser.add_argument('--compare', default = None, help = "JSON file of an earlier run to compare against")
+    argParser.add_argument('--tolerance', type = float, default = DEFAULT_TOLERANCE,
+        help = "allowed relative slowdown before a rate counts as a regression")
+    options = argParser.parse_args(args)
+    sizes = [int(size) for size in options.sizes.split(",")]
+    mix = json.loads(options.mix) if options.mix else DEFAULT_MIX
+    document = runSuite(sizes, options.depth, mix, options.points, options.repeat, options.seed)
+    printResults(document)
+    if options.output:
+        with open(options.output, 'w') as file:
+            json.dump(document, file, indent = 2)
+    if options.compare:
+        with open(options.compare) as file:
+            baseline = json.load(file)
+        regressions = findRegressions(baseline, document, options.tolerance)
+        for size, metric, before, after in regressions:
+            print("regression: size %s %s %.0f -> %.0f" % (size, metric, before, after))
+        if len(regressions) > 0:
+            return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,122 @@
+#Bounded LRU cache in front of Function construction.  Strings that
+#only differ in insignificant spaces share one parsed Function
+import re
+import threading
+from collections import OrderedDict
+from function_parser import Function
+
+DEFAULT_SIZE = 1024
+
+SPACES = re.compile(r' +')
+
+#Characters that make up numbers and names.  A space between two of
+#them can separate tokens ("2 3" is 2*3, not 23) so it has to stay
+WORD_CHARS = set('0123456789.abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ_')
+DIGITS = set('0123456789.')
+
+#Is the space between strVal[start - 1] and strVal[end] needed to keep
+#the tokens apart?  A number followed by a letter never merges with it
+def isSignificantSpace(strVal, start, end):
+    if start == 0 or end == len(strVal):
+        return False
+    if strVal[start - 1] not in WORD_CHARS or strVal[end] not in WORD_CHARS:
+        return False
+    wordStart = start - 1
+    while wordStart > 0 and strVal[wordStart - 1] in WORD_CHARS:
+        wordStart -= 1
+    return not (strVal[wordStart] in DIGITS and strVal[end] not in DIGITS)
+
+#Cache key for a function string: drop every space the lexer would
+#skip anyway and shrink the significant ones to a single space
+def normalize(strVal):
+    def replace(match):
+        if isSignificantSpace(strVal, match.start(), match.end()):
+            return ' '
+        return ''
+    return SPACES.sub(replace, strVal)
+
+#Thread safe LRU cache of Function objects keyed by normalized source.
+#The Functions are shared between callers and should not be changed
+class FunctionCache:
+    def __init__(self, maxSize = DEFAULT_SIZE, optimize = True):
+        self.__maxSize = maxSize
+        self.__optimize = optimize
+        self.__functions = OrderedDict()
+        self.__lock = threading.Lock()
+        self.__hits = 0
+        self.__misses = 0
+        self.__evictions = 0
+
+    #Return the cached Function for strVal, parsing it on a miss
+    def getFunction(self, strVal):
+        key = normalize(strVal)
+        with self.__lock:
+            function = self.__functions.get(key)
+            if function is not None:
+                self.__functions.move_to_end(key)
+                self.__hits += 1
+                return function
+            self.__misses += 1
+        #Parse outside the lock so other lookups are not blocked
+        function = Function(key, self.__optimize)
+        with self.__lock:
+            if key not in self.__functions:
+                self.__functions[key] = function
+            self.__functions.move_to_end(key)
+            self.__evict()
+            return self.__functions.get(key, function)
+
+    #Remove least recently used entries until the cache fits its size
+    def __evict(self):
+        while len(self.__functions) > self.__maxSize:
+            self.__functions.popitem(last = False)
+            self.__evictions += 1
+
+    def setMaxSize(self, maxSize):
+        with self.__lock:
+            self.__maxSize = maxSize
+            self.__evict()
+
+    def getMaxSize(self):
+        return self.__maxSize
+
+    def getHits(self):
+        return self.__hits
+
+    def getMisses(self):
+        return self.__misses
+
+    def getEvictions(self):
+        return self.__evictions
+
+    #Snapshot of the counters for sizing the cache
+    def getStats(self):
+        with self.__lock:
+            return {
+                'size' : len(self.__functions),
+                'maxSize' : self.__maxSize,
+                'hits' : self.__hits,
+                'misses' : self.__misses,
+                'evictions' : self.__evictions
+            }
+
+    #Drop every entry and reset the counters
+    def clear(self):
+        with self.__lock:
+            self.__functions.clear()
+            self.__hits = 0
+            self.__misses = 0
+            self.__evictions = 0
+
+    def __len__(self):
+        return len(self.__functions)
+
+    def __contains__(self, strVal):
+        return normalize(strVal) in self.__functions
+
+#Process wide cache used by getFunction
+defaultCache = FunctionCache()
+
+#Get a parsed Function for strVal from the process wide cache
+def getFunction(strVal):
+    return defaultCache.getFunction(strVal)
@@ -0,0 +1,127 @@
+#Compiler that turns a parsed function tree into one generated
+#Python function, so evaluation is a single call with no per-node
+#type checks or operator table lookups
+import math
+from function_parser import OPERATOR, postorderRoots
+
+#Python operator used for each tree operator in the generated source.
+#Division is not listed because it goes through OPERATOR's division
+#to keep the signed infinity result for division by zero.  The array
+#kernel calls OPERATOR's elementwise power instead of '**', which would
+#give complex numbers or raise on constant operands
+OPERATOR_SOURCE = {
+    '+' : '+',
+    '-' : '-',
+    '*' : '*',
+    '^' : '**'
+}
+
+#Kernel argument of a variable.  Names other than x and y get a prefix,
+#so they cannot clash with Python keywords or the generated names
+def argumentName(variable):
+    if variable == 'x' or variable == 'y':
+        return variable
+    return "v_" + variable
+
+#Generates the source of
+#  def kernel(x, y):
+#      t0 = ...
+#      return tN
+#with one assignment per operator node, and the same source with the
+#powers as _pow calls for arrays.  root can also be a list of
+#roots; the kernel then returns a tuple with the value of each, and
+#nodes the trees share are computed once.  The kernel takes one argument
+#per name in variables, x and y by default
+class Compiler:
+    def __init__(self, root, variables = None):
+        if variables is None:
+            variables = ['x', 'y']
+        self.__arguments = {}
+        for variable in variables:
+            self.__arguments[variable] = argumentName(variable)
+        self.__lines = []
+        self.__arrayLines = []
+        self.__names = {}
+        self.__constants = {}
+        self.__calls = []
+        roots = root if type(root) == list else [root]
+        for node in postorderRoots(roots):
+            self.__emit(node)
+        if type(root) == list:
+            self.__append("return (" + "".join(self.__names[id(node)] + ", " for node in roots) + ")")
+        else:
+            self.__append("return " + self.__names[id(root)])
+        header = "def kernel(" + ", ".join(argumentName(variable) for variable in variables) + "):\n    "
+        self.__source = header + "\n    ".join(self.__lines) + "\n"
+        self.__arraySource = header + "\n    ".join(self.__arrayLines) + "\n"
+
+    #Add a line to both sources, arrayLine instead of line to the array one
+    def __append(self, line, arrayLine = None):
+        self.__lines.append(line)
+        self.__arrayLines.append(arrayLine or line)
+
+    #Source text for a number.  repr round trips every finite
+    #value; inf and nan are bound as names in the kernel namespace.
+    #Negative numbers are parenthesized so -2 ** y stays (-2) ** y
+    def __literal(self, val):
+        if type(val) == int or math.isfinite(val):
+            text = repr(val)
+            if text.startswith('-'):
+                return "(" + text + ")"
+            return text
+        name = "_c" + str(len(self.__constants))
+        self.__constants[name] = val
+        return name
+
+    #Record the expression that holds the value of node, writing an
+    #assignment for operator nodes.  Nodes come in postorder, so the
+    #children already have their names
+    def __emit(self, node):
+        key = id(node)
+        val = node.getVal()
+        valType = type(val)
+        if valType == int or valType == float:
+            self.__names[key] = self.__literal(val)
+            return
+        elif node.getLeft() is None:
+            if val not in self.__arguments:
+                raise ValueError("unknown variable " + repr(val))
+            self.__names[key] = self.__arguments[val]
+            return
+        left = self.__names[id(node.getLeft())]
+        name = "t" + str(len(self.__lines))
+        if node.getRight() is None:
+            #Named functions are bound as _f_<name> in getKernel
+            if val not in self.__calls:
+                self.__calls.append(val)
+            self.__append(name + " = _f_" + val + "(" + left + ")")
+            self.__names[key] = name
+            return
+        right = self.__names[id(node.getRight())]
+        if val == '/':
+            self.__append(name + " = _div(" + left + ", " + right + ")")
+        elif val == '^':
+            self.__append(name + " = " + left + " ** " + right, name + " = _pow(" + left + ", " + right + ")")
+        else:
+            self.__append(name + " = " + left + " " + OPERATOR_SOURCE[val] + " " + right)
+        self.__names[key] = name
+
+    def getSource(self, array = False):
+        if array:
+            return self.__arraySource
+        return self.__source
+
+    #Build the kernel.  With array=True division, powers and named
+    #functions use the elementwise versions, so it evaluates numpy arrays
+    def getKernel(self, array = False):
+        if array:
+            getOperation = OPERATOR.getArrayOperation
+        else:
+            getOperation = OPERATOR.getOperation
+        namespace = {'_div' : getOperation('/'), '_pow' : getOperation('^')}
+        for call in self.__calls:
+            namespace['_f_' + call] = getOperation(call)
+        namespace.update(self.__constants)
+        code = compile(self.getSource(array), "<function kernel>", "exec")
+        exec(code, namespace)
+        return namespace['kernel']
@@ -0,0 +1,128 @@
+#Symbolic differentiation of function trees.  The derivative is built as
+#a new tree with the usual rules for + - * / ^ and the chain rule for
+#named functions, and is meant to be passed through the optimizer
+#afterwards (Function does this)
+import math
+from function_parser import NodeTable, Parser, FUNCTIONS, postorder, formatNode, isConstant
+
+#Builds the partial derivative of the tree under root with respect to
+#variable.  Derivatives that are zero are kept as None while building,
+#so subtrees that do not depend on the variable add no nodes
+class Differentiator:
+    def __init__(self, root, variable, nodes = None):
+        if nodes is None:
+            nodes = NodeTable()
+        self.__nodes = nodes
+        self.__variable = variable
+        self.__derivatives = {}
+        self.__outer = {}
+        for node in postorder(root):
+            self.__derivatives[id(node)] = self.__differentiate(node)
+        result = self.__derivatives[id(root)]
+        if result is None:
+            result = self.__nodes.getNode(0)
+        self.__root = result
+
+    def getRoot(self):
+        return self.__root
+
+    def __node(self, value, left = None, right = None):
+        return self.__nodes.getNode(value, left, right)
+
+    #Sum of two derivatives, either of which may be zero (None)
+    def __add(self, left, right):
+        if left is None:
+            return right
+        if right is None:
+            return left
+        return self.__node('+', left, right)
+
+    #Product of a node and a derivative that may be zero (None)
+    def __mul(self, left, right):
+        if left is None or right is None:
+            return None
+        return self.__node('*', left, right)
+
+    #Derivative of node; the derivatives of its children are already known
+    def __differentiate(self, node):
+        val = node.getVal()
+        left = node.getLeft()
+        right = node.getRight()
+        if left is None:
+            if val == self.__variable:
+                return self.__node(1)
+            return None
+        dLeft = self.__derivatives[id(left)]
+        if right is None:
+            #f(u)' = f'(u) u'
+            if dLeft is None:
+                return None
+            return self.__node('*', self.__outerDerivative(val, left), dLeft)
+        dRight = self.__derivatives[id(right)]
+        if dLeft is None and dRight is None:
+            return None
+        if val == '+':
+            return self.__add(dLeft, dRight)
+        elif val == '-':
+            if dRight is None:
+                return dLeft
+            if dLeft is None:
+                return self.__node('-', self.__node(0), dRight)
+            return self.__node('-', dLeft, dRight)
+        elif val == '*':
+            return self.__add(self.__mul(dLeft, right), self.__mul(left, dRight))
+        elif val == '/':
+            #(u/v)' = u'/v - u v'/v^2
+            quotient = None
+            if dLeft is not None:
+                quotient = self.__node('/', dLeft, right)
+            if dRight is None:
+                return quotient
+            square = self.__node('^', right, self.__node(2))
+            correction = self.__node('/', self.__node('*', left, dRight), square)
+            if quotient is None:
+                return self.__node('-', self.__node(0), correction)
+            return self.__node('-', quotient, correction)
+        else:
+            return self.__differentiatePower(node, left, right, dLeft, dRight)
+
+    #Derivative of the named function at arg: the registered derivative
+    #text, parsed once per name, with arg put in place of x
+    def __outerDerivative(self, name, arg):
+        function = FUNCTIONS.get(name)
+        if function is None or function.getDerivative() is None:
+            raise ValueError("cannot differentiate " + name + ": it was registered without a derivative")
+        if name not in self.__outer:
+            self.__outer[name] = Parser("z=" + function.getDerivative()).getRoot()
+        root = self.__outer[name]
+        copies = {}
+        for node in postorder(root):
+            if node.getLeft() is None:
+                if node.getVal() == 'x':
+                    copies[id(node)] = arg
+                else:
+                    copies[id(node)] = self.__node(node.getVal())
+            elif node.getRight() is None:
+                copies[id(node)] = self.__node(node.getVal(), copies[id(node.getLeft())])
+            else:
+                copies[id(node)] = self.__node(node.getVal(), copies[id(node.getLeft())],
+                    copies[id(node.getRight())])
+        return copies[id(root)]
+
+    #(u^v)' = v u^(v-1) u'  when v does not depend on the variable
+    #(u^v)' = u^v ln(u) v'  when u is a positive number
+    #(u^v)' = u^v (v' ln(u) + v u'/u)  otherwise
+    def __differentiatePower(self, node, left, right, dLeft, dRight):
+        if dRight is None:
+            exponent = self.__node('-', right, self.__node(1))
+            power = self.__node('^', left, exponent)
+            return self.__node('*', self.__node('*', right, power), dLeft)
+        if dLeft is None and isConstant(left) and left.getVal() > 0:
+            logBase = self.__node(math.log(left.getVal()))
+            return self.__node('*', self.__node('*', node, logBase), dRight)
+        if 'log' not in FUNCTIONS:
+            raise ValueError("cannot differentiate " + formatNode(node) + ": a power with a variable exponent needs log")
+        inner = self.__mul(dRight, self.__node('log', left))
+        if dLeft is not None:
+            inner = self.__add(inner, self.__node('/', self.__node('*', right, dLeft), left))
+        return self.__node('*', node, inner)
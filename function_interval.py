@@ -0,0 +1,243 @@
+#Interval arithmetic over function trees.  An interval is a (lo, hi) tuple
+#of floats and evaluating a tree over intervals for x and y gives bounds
+#that hold for every point of the box, e.g. to skip regions where
+#z=f(x,y) cannot reach a level:
+#  lo, hi = Function("z=x^2-y").evalInterval((0.0, 1.0), (2.0, 3.0))
+#Every result is rounded outwards by one unit in the last place so float
+#rounding cannot make the bounds too tight.  Points where the function is
+#nan (a negative base with a fractional exponent, log of a negative
+#number) are not bounded.  Named functions use the interval of their
+#registration; functions registered without one are unbounded, even when
+#they replace a built-in
+import math
+from function_parser import (FUNCTIONS, STEP_NUMBER, STEP_VARIABLE, STEP_CALL,
+    postorder)
+
+INFINITE = (-math.inf, math.inf)
+
+#Interval for a number or a (lo, hi) pair
+def toInterval(value):
+    if type(value) == tuple:
+        lo, hi = value
+        if lo > hi:
+            raise ValueError("empty interval (" + str(lo) + ", " + str(hi) + ")")
+        return (float(lo), float(hi))
+    val = float(value)
+    if type(value) == int and val != value:
+        return widen(val, val)
+    return (val, val)
+
+#Round lo down and hi up by one unit in the last place.  A nan bound
+#means the side is not known, so it becomes infinite
+def widen(lo, hi):
+    if math.isnan(lo):
+        lo = -math.inf
+    if math.isnan(hi):
+        hi = math.inf
+    return (math.nextafter(lo, -math.inf), math.nextafter(hi, math.inf))
+
+def add(a, b):
+    return widen(a[0] + b[0], a[1] + b[1])
+
+def subtract(a, b):
+    return widen(a[0] - b[1], a[1] - b[0])
+
+#Product of two bounds where 0 times infinity is 0
+def multiplyBounds(a, b):
+    if a == 0 or b == 0:
+        return 0.0
+    return a * b
+
+def multiply(a, b):
+    products = [multiplyBounds(a[0], b[0]), multiplyBounds(a[0], b[1]),
+        multiplyBounds(a[1], b[0]), multiplyBounds(a[1], b[1])]
+    return widen(min(products), max(products))
+
+#Division with the infinities of OPERATOR.__realDiv: x/0 is -inf for
+#x < 0 and inf otherwise.  A divisor that contains 0 makes the quotient
+#unbounded on at least one side
+def divide(a, b):
+    aLo, aHi = a
+    bLo, bHi = b
+    if bLo > 0 or bHi < 0:
+        quotients = [aLo / bLo, aLo / bHi, aHi / bLo, aHi / bHi]
+        if any(math.isnan(q) for q in quotients):
+            return INFINITE
+        return widen(min(quotients), max(quotients))
+    if bLo == 0 and bHi == 0:
+        return (-math.inf if aLo < 0 else math.inf, math.inf if aHi >= 0 else -math.inf)
+    if bLo == 0:
+        #y in (0, bHi] and x of one sign; y == 0 adds inf or -inf
+        if aLo >= 0:
+            return widen(aLo / bHi, math.inf)
+        if aHi < 0:
+            return widen(-math.inf, aHi / bHi)
+    return INFINITE
+
+#a ** e for a >= 0, overflow and 0 to a negative power giving inf
+def powerBound(a, e):
+    try:
+        return float(a) ** e
+    except (OverflowError, ZeroDivisionError):
+        return math.inf
+
+#Is the interval a single integer?
+def isInteger(e):
+    return e[0] == e[1] and math.isfinite(e[0]) and e[0] == int(e[0])
+
+#Base to the power of a single integer n
+def integerPower(a, n):
+    lo, hi = a
+    if n == 0:
+        return (1.0, 1.0)
+    if n < 0:
+        return divide((1.0, 1.0), integerPower(a, -n))
+    if n % 2 == 1 or lo >= 0:
+        return widen(signedPower(lo, n), signedPower(hi, n))
+    if hi <= 0:
+        return widen(powerBound(-hi, n), powerBound(-lo, n))
+    return widen(0.0, max(powerBound(-lo, n), powerBound(hi, n)))
+
+#a ** n for any a and positive integer n
+def signedPower(a, n):
+    if a < 0:
+        return -powerBound(-a, n)
+    return powerBound(a, n)
+
+#Bounds of a ** e for a >= 0.  The power is monotonic in the base and in
+#the exponent, so the extremes are at the corners
+def positivePower(a, e):
+    corners = [powerBound(a[0], e[0]), powerBound(a[0], e[1]),
+        powerBound(a[1], e[0]), powerBound(a[1], e[1])]
+    if any(math.isnan(c) for c in corners):
+        return INFINITE
+    return widen(min(corners), max(corners))
+
+#Power with the semantics of '^': an integer exponent works for any base,
+#a negative base with other exponents only has real values at integers,
+#whose size is bounded by the power of the largest absolute base
+def power(a, e):
+    if isInteger(e):
+        return integerPower(a, int(e[0]))
+    if a[0] >= 0:
+        return positivePower(a, e)
+    magnitude = (0.0 if a[1] >= 0 else -a[1], max(-a[0], a[1]))
+    bound = positivePower(magnitude, e)[1]
+    return (-bound, bound)
+
+#Monotonic functions map the bounds of the argument
+def intervalExp(a):
+    return widen(powerBound(math.e, a[0]), powerBound(math.e, a[1]))
+
+def intervalLog(a):
+    lo = math.log(a[0]) if a[0] > 0 else -math.inf
+    hi = math.log(a[1]) if a[1] > 0 else -math.inf
+    return widen(lo, hi)
+
+def intervalSqrt(a):
+    hi = math.sqrt(a[1]) if a[1] >= 0 else 0.0
+    return widen(math.sqrt(max(a[0], 0.0)), hi)
+
+#Slack for finding the extrema of sin and cos in an interval, so
+#rounding of the multiples of pi can only add an extremum
+PERIOD_SLACK = 1e-9
+
+#Bounds of a function with period 2 pi, 1 at peak and -1 at peak + pi,
+#and monotonic in between, like sin (peak pi/2) and cos (peak 0)
+def periodicInterval(a, function, peak):
+    lo, hi = a
+    if not (math.isfinite(lo) and math.isfinite(hi)) or hi - lo >= 2 * math.pi:
+        return (-1.0, 1.0)
+    #Is there a k with offset + 2 pi k in the interval?
+    def reaches(offset):
+        first = math.ceil((lo - offset) / (2 * math.pi) - PERIOD_SLACK)
+        return offset + 2 * math.pi * first <= hi + PERIOD_SLACK * (1 + abs(hi))
+    ends = [function(lo), function(hi)]
+    bounds = widen(min(ends), max(ends))
+    bottom = -1.0 if reaches(peak + math.pi) else max(bounds[0], -1.0)
+    top = 1.0 if reaches(peak) else min(bounds[1], 1.0)
+    return (bottom, top)
+
+def intervalSin(a):
+    return periodicInterval(a, math.sin, math.pi / 2)
+
+def intervalCos(a):
+    return periodicInterval(a, math.cos, 0.0)
+
+#Intervals of the built-in named functions, which function_parser
+#registers them with
+FUNCTION_INTERVALS = {
+    'sin' : intervalSin,
+    'cos' : intervalCos,
+    'log' : intervalLog,
+    'exp' : intervalExp,
+    'sqrt' : intervalSqrt
+}
+
+#A named function without a known interval can take any value
+def unbounded(a):
+    return INFINITE
+
+INTERVAL_TABLE = {
+    '+' : add,
+    '-' : subtract,
+    '*' : multiply,
+    '/' : divide,
+    '^' : power
+}
+
+def getIntervalOperation(opChar):
+    operation = INTERVAL_TABLE.get(opChar)
+    if operation is not None:
+        return operation
+    function = FUNCTIONS.get(opChar)
+    if function is not None and function.getInterval() is not None:
+        return function.getInterval()
+    return unbounded
+
+#Bounds of the nodes in order (children before parents) over the box
+#x times y, where x and y are numbers or (lo, hi) pairs
+def evalIntervalNodes(order, x, y):
+    variables = {'x' : toInterval(x), 'y' : toInterval(y)}
+    results = {}
+    for node in order:
+        val = node.getVal()
+        valType = type(val)
+        if valType == int or valType == float:
+            results[id(node)] = toInterval(val)
+        elif node.getLeft() is None:
+            results[id(node)] = variables[val]
+        elif node.getRight() is None:
+            operation = getIntervalOperation(val)
+            results[id(node)] = operation(results[id(node.getLeft())])
+        else:
+            operation = INTERVAL_TABLE[val]
+            results[id(node)] = operation(results[id(node.getLeft())], results[id(node.getRight())])
+    return results[id(order[-1])]
+
+#Bounds of an evaluation plan (see function_parser.makePlan) over the box
+#given by one number or (lo, hi) pair per variable slot
+def evalIntervalPlan(plan, values):
+    boxes = [toInterval(value) for value in values]
+    results = []
+    for step in plan:
+        kind = step[0]
+        if kind == STEP_NUMBER:
+            results.append(toInterval(step[1]))
+        elif kind == STEP_VARIABLE:
+            results.append(boxes[step[1]])
+        elif kind == STEP_CALL:
+            results.append(getIntervalOperation(step[1])(results[step[2]]))
+        else:
+            results.append(INTERVAL_TABLE[step[1]](results[step[2]], results[step[3]]))
+    return results[-1]
+
+#Bounds of the tree under root over the box x times y
+def evalInterval(root, x, y):
+    return evalIntervalNodes(postorder(root), x, y)
+
+#Can the function take the value level somewhere in the box?  False
+#means it certainly cannot, so the box can be skipped
+def mayContain(function, level, x, y):
+    lo, hi = function.evalInterval(x, y)
+    return lo <= level <= hi
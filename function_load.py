@@ -0,0 +1,153 @@
+#Load generator for function_server.  A number of clients send point
+#requests over their own connections, each keeping up to pipeline
+#requests in flight, and the run reports throughput, latency percentiles
+#and how well the server batched.  Without --port a server is started in
+#the same process on a free port.
+#  python function_load.py --clients 32 --requests 2000 --points 1
+#  python function_load.py --port 7341 --function "z=x^2+y^2"
+import argparse
+import asyncio
+import json
+import random
+import time
+from function_server import FunctionServer, DEFAULT_HOST, DEFAULT_BATCH_DELAY, MAX_LINE
+
+DEFAULT_FUNCTION = "z=3x^2-2xy+y^3/(x^2+1)"
+DEFAULT_CLIENTS = 16
+DEFAULT_REQUESTS = 1000
+DEFAULT_POINTS = 1
+DEFAULT_PIPELINE = 8
+
+#Value at fraction q (0 to 1) of sorted values
+def percentile(values, q):
+    if len(values) == 0:
+        return 0.0
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+#Request of count random points, one point as x and y
+def makeRequest(requestId, function, count, rand):
+    request = {'id' : requestId, 'function' : function}
+    if count == 1:
+        request['x'] = rand.uniform(-2.0, 2.0)
+        request['y'] = rand.uniform(-2.0, 2.0)
+    else:
+        request['xs'] = [rand.uniform(-2.0, 2.0) for i in range(count)]
+        request['ys'] = [rand.uniform(-2.0, 2.0) for i in range(count)]
+    return request
+
+#One client: send requests on one connection with up to pipeline of them
+#unanswered.  Returns (latencies in seconds, error count)
+async def runClient(host, port, function, requests, points, pipeline, seed):
+    rand = random.Random(seed)
+    reader, writer = await asyncio.open_connection(host, port, limit = MAX_LINE)
+    sent = {}
+    latencies = []
+    errors = 0
+    window = asyncio.Semaphore(pipeline)
+
+    async def receive():
+        nonlocal errors
+        for i in range(requests):
+            response = json.loads(await reader.readline())
+            latencies.append(time.perf_counter() - sent.pop(response['id']))
+            if 'error' in response:
+                errors += 1
+            window.release()
+
+    receiver = asyncio.ensure_future(receive())
+    for i in range(requests):
+        await window.acquire()
+        request = makeRequest(i, function, points, rand)
+        sent[i] = time.perf_counter()
+        writer.write(json.dumps(request).encode('utf-8') + b'\n')
+        await writer.drain()
+    await receiver
+    writer.close()
+    await writer.wait_closed()
+    return (latencies, errors)
+
+#Ask the server for its counters
+async def fetchStats(host, port):
+    reader, writer = await asyncio.open_connection(host, port, limit = MAX_LINE)
+    writer.write(b'{"id": "stats", "op": "stats"}\n')
+    await writer.drain()
+    response = json.loads(await reader.readline())
+    writer.close()
+    await writer.wait_closed()
+    return response['stats']
+
+#Run clients against the server at host and port.  Returns a dict of
+#results, with the server counters for this run under 'server'
+async def runLoad(host, port, function = DEFAULT_FUNCTION, clients = DEFAULT_CLIENTS,
+        requests = DEFAULT_REQUESTS, points = DEFAULT_POINTS, pipeline = DEFAULT_PIPELINE, seed = 0):
+    before = await fetchStats(host, port)
+    start = time.perf_counter()
+    runs = await asyncio.gather(*[runClient(host, port, function, requests, points, pipeline, seed + i)
+        for i in range(clients)])
+    seconds = time.perf_counter() - start
+    after = await fetchStats(host, port)
+    latencies = sorted(latency for run in runs for latency in run[0])
+    total = clients * requests
+    batches = after['batches'] - before['batches']
+    return {
+        'requests' : total,
+        'errors' : sum(run[1] for run in runs),
+        'seconds' : seconds,
+        'requestsPerSecond' : total / seconds,
+        'pointsPerSecond' : total * points / seconds,
+        'latencyP50' : percentile(latencies, 0.5),
+        'latencyP95' : percentile(latencies, 0.95),
+        'latencyP99' : percentile(latencies, 0.99),
+        'latencyMax' : latencies[-1] if len(latencies) > 0 else 0.0,
+        'server' : {
+            'batches' : batches,
+            'pointsPerBatch' : (after['points'] - before['points']) / batches if batches > 0 else 0.0
+        }
+    }
+
+#Run the load against an in-process server on a free port
+async def runLocal(batchDelay = DEFAULT_BATCH_DELAY, **options):
+    server = FunctionServer(DEFAULT_HOST, 0, batchDelay = batchDelay)
+    await server.start()
+    try:
+        return await runLoad(DEFAULT_HOST, server.getPort(), **options)
+    finally:
+        await server.close()
+
+def printResults(results):
+    print("%d requests in %.2f s, %d errors" % (results['requests'], results['seconds'], results['errors']))
+    print("%.0f requests/s, %.0f points/s" % (results['requestsPerSecond'], results['pointsPerSecond']))
+    print("latency ms: p50 %.3f  p95 %.3f  p99 %.3f  max %.3f" % (1000 * results['latencyP50'],
+        1000 * results['latencyP95'], 1000 * results['latencyP99'], 1000 * results['latencyMax']))
+    print("server: %d batches, %.1f points per batch" % (results['server']['batches'],
+        results['server']['pointsPerBatch']))
+
+def main(args = None):
+    argParser = argparse.ArgumentParser(description = "Generate load for function_server")
+    argParser.add_argument('--host', default = DEFAULT_HOST, help = "server address")
+    argParser.add_argument('--port', type = int, default = None,
+        help = "server port; without it a server is started in this process")
+    argParser.add_argument('--function', default = DEFAULT_FUNCTION, help = "function to evaluate")
+    argParser.add_argument('--clients', type = int, default = DEFAULT_CLIENTS, help = "concurrent connections")
+    argParser.add_argument('--requests', type = int, default = DEFAULT_REQUESTS, help = "requests per client")
+    argParser.add_argument('--points', type = int, default = DEFAULT_POINTS, help = "points per request")
+    argParser.add_argument('--pipeline', type = int, default = DEFAULT_PIPELINE,
+        help = "requests a client keeps in flight")
+    argParser.add_argument('--batch-delay', type = float, default = DEFAULT_BATCH_DELAY,
+        help = "batch delay of the in-process server")
+    argParser.add_argument('--seed', type = int, default = 0, help = "random seed")
+    argParser.add_argument('--json', action = 'store_true', help = "print the results as JSON")
+    options = argParser.parse_args(args)
+    load = {'function' : options.function, 'clients' : options.clients, 'requests' : options.requests,
+        'points' : options.points, 'pipeline' : options.pipeline, 'seed' : options.seed}
+    if options.port is None:
+        results = asyncio.run(runLocal(options.batch_delay, **load))
+    else:
+        results = asyncio.run(runLoad(options.host, options.port, **load))
+    if options.json:
+        print(json.dumps(results, indent = 2))
+    else:
+        printResults(results)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,134 @@
+#Out-of-core grid evaluation.  The grid is evaluated tile by tile and each
+#tile is written straight into a memory-mapped .npy file.  Only the band
+#of rows the current tiles are in is mapped, so memory use is bounded by
+#the tile rows times the grid width, not by the size of the grid.  Progress is
+#kept in a small JSON file next to the output ("out.npy.progress") after
+#every tile; an interrupted run started again with the same arguments
+#carries on from the first tile that was not finished.  The progress file
+#is removed when the grid is complete.
+#  Function("z=x^2+y^2").evalGridToFile(xs, ys, "surface.npy", 2048, 'float32')
+#  surface = readGrid("surface.npy")
+import hashlib
+import json
+import os
+from function_parser import requireNumpy, numpy
+
+DEFAULT_TILE_SIZE = 1024
+
+PROGRESS_SUFFIX = ".progress"
+
+#Name of the progress file of an output file
+def progressPath(path):
+    return path + PROGRESS_SUFFIX
+
+#Digest of the axes, so a run is only resumed over the same grid
+def axesDigest(xs, ys):
+    digest = hashlib.sha1()
+    digest.update(xs.tobytes())
+    digest.update(b'|')
+    digest.update(ys.tobytes())
+    return digest.hexdigest()
+
+#Tiles (first row, end row, first column, end column) of a rows x cols
+#grid in row-major order, tileSize being rows and columns per tile
+def gridTiles(rows, cols, tileSize):
+    tileRows, tileCols = tileSize
+    tiles = []
+    for row0 in range(0, rows, tileRows):
+        for col0 in range(0, cols, tileCols):
+            tiles.append((row0, min(row0 + tileRows, rows), col0, min(col0 + tileCols, cols)))
+    return tiles
+
+#Progress file contents read from path, None if there is none
+def readProgress(path):
+    try:
+        with open(progressPath(path)) as file:
+            return json.load(file)
+    except FileNotFoundError:
+        return None
+
+#Replace the progress file in one step so a crash leaves the old or the new one
+def writeProgress(path, progress):
+    temp = progressPath(path) + ".tmp"
+    with open(temp, 'w') as file:
+        json.dump(progress, file)
+    os.replace(temp, progressPath(path))
+
+#Evaluate function over the grid spanned by xs and ys (like
+#Function.evalGrid) into the .npy file at path, tile by tile.
+#tileSize is rows and columns per tile, one number for square tiles.
+#With resume, a run of the same function, grid, tile size and dtype that
+#was interrupted is continued; anything else at path is overwritten.
+#progress, if given, is called after every tile with the tiles done and
+#the tile count.  Returns the number of tiles evaluated by this call
+def evalGridToFile(function, xs, ys, path, tileSize = DEFAULT_TILE_SIZE, dtype = 'float64',
+        resume = True, progress = None):
+    requireNumpy()
+    xs = numpy.ascontiguousarray(xs, dtype = float)
+    ys = numpy.ascontiguousarray(ys, dtype = float)
+    if type(tileSize) == int:
+        tileSize = (tileSize, tileSize)
+    tileSize = [int(size) for size in tileSize]
+    dtype = numpy.dtype(dtype)
+    shape = (len(ys), len(xs))
+    tiles = gridTiles(shape[0], shape[1], tileSize)
+    state = {
+        'source' : function.getSource(),
+        'shape' : list(shape),
+        'dtype' : dtype.str,
+        'tileSize' : tileSize,
+        'axes' : axesDigest(xs, ys),
+        'tilesDone' : 0
+    }
+    saved = readProgress(path)
+    done = 0
+    if resume and saved is not None and os.path.exists(path):
+        same = all(saved.get(key) == value for key, value in state.items() if key != 'tilesDone')
+        if same:
+            done = saved['tilesDone']
+    if done > 0:
+        output = numpy.lib.format.open_memmap(path, mode = 'r+')
+    else:
+        output = numpy.lib.format.open_memmap(path, mode = 'w+', dtype = dtype, shape = shape)
+        writeProgress(path, state)
+    offset = output.offset
+    del output
+    function.ensureCompiled()
+    rowBytes = shape[1] * dtype.itemsize
+    band = None
+    bandStart = None
+    count = 0
+    try:
+        for index in range(done, len(tiles)):
+            row0, row1, col0, col1 = tiles[index]
+            if bandStart != row0:
+                #Unmap the finished band before mapping the next one
+                band = None
+                band = numpy.memmap(path, dtype = dtype, mode = 'r+',
+                    offset = offset + row0 * rowBytes, shape = (row1 - row0, shape[1]))
+                bandStart = row0
+            band[:, col0:col1] = function.evalGrid(xs[col0:col1], ys[row0:row1])
+            #The tile has to be on disk before the progress says so
+            band.flush()
+            state['tilesDone'] = index + 1
+            writeProgress(path, state)
+            count += 1
+            if progress is not None:
+                progress(index + 1, len(tiles))
+    finally:
+        del band
+    os.remove(progressPath(path))
+    return count
+
+#Is the grid at path complete, i.e. not waiting to be resumed?
+def isComplete(path):
+    return os.path.exists(path) and not os.path.exists(progressPath(path))
+
+#Open a grid written by evalGridToFile as a read-only memory map,
+#without reading it into memory.  An unfinished grid is refused unless
+#partial is set
+def readGrid(path, partial = False):
+    requireNumpy()
+    if not partial and os.path.exists(progressPath(path)):
+        raise ValueError(path + " is not complete; evaluate it again to resume")
+    return numpy.load(path, mmap_mode = 'r')
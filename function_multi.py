@@ -0,0 +1,103 @@
+#Evaluation of many Functions over the same points in one pass.  The
+#trees are merged through one NodeTable, so a subtree that appears in
+#several functions (x^2, y^3, x*y, ...) becomes one node and is computed
+#once for all of them.  Operands of + and * are put in a fixed order
+#first, so x*y and y*x merge too; that does not change any result.
+#  layers = MultiFunction([Function("z=x^2+y"), Function("z=x^2*y")])
+#  values = layers.evalGrid(xs, ys)      shape (2, len(ys), len(xs))
+#  layers.getSavedEvaluations()          node evaluations saved per point
+from function_parser import (NodeTable, OPERATOR, postorderRoots,
+    evalNodeResults, evalBroadcast, countNodes, requireNumpy, numpy)
+
+#Operators whose operands can be swapped without changing the result
+COMMUTATIVE = ['+', '*']
+
+#Copy the trees of roots into nodes.  Returns the new roots
+def mergeRoots(roots, nodes):
+    merged = {}
+    for node in postorderRoots(roots):
+        if node.getLeft() is None:
+            merged[id(node)] = nodes.getNode(node.getVal())
+            continue
+        left = merged[id(node.getLeft())]
+        if node.getRight() is None:
+            merged[id(node)] = nodes.getNode(node.getVal(), left)
+            continue
+        right = merged[id(node.getRight())]
+        if node.getVal() in COMMUTATIVE and id(right) < id(left):
+            left, right = right, left
+        merged[id(node)] = nodes.getNode(node.getVal(), left, right)
+    return [merged[id(root)] for root in roots]
+
+class MultiFunction:
+    def __init__(self, functions):
+        self.__functions = list(functions)
+        for function in self.__functions:
+            if function.getVariables() != ['x', 'y']:
+                raise ValueError("MultiFunction takes functions of x and y")
+        self.__nodes = NodeTable()
+        self.__roots = mergeRoots([function.getRoot() for function in self.__functions], self.__nodes)
+        self.__order = postorderRoots(self.__roots)
+        self.__separateNodes = sum(countNodes(function.getRoot()) for function in self.__functions)
+        self.__kernel = None
+        self.__arrayKernel = None
+
+    def getFunctions(self):
+        return self.__functions
+
+    #Roots of the merged graph, one per function
+    def getRoots(self):
+        return self.__roots
+
+    def __len__(self):
+        return len(self.__functions)
+
+    #Nodes evaluated per point when every function is evaluated on its own
+    def getSeparateNodes(self):
+        return self.__separateNodes
+
+    #Nodes evaluated per point by the merged graph
+    def getSharedNodes(self):
+        return len(self.__order)
+
+    #Node evaluations per point the merged graph saves
+    def getSavedEvaluations(self):
+        return self.__separateNodes - len(self.__order)
+
+    #Generate one kernel that returns the values of all the functions;
+    #see Function.compile
+    def compile(self):
+        if self.__kernel is None:
+            from function_compiler import Compiler
+            compiler = Compiler(self.__roots)
+            self.__kernel = compiler.getKernel()
+            if numpy is not None:
+                self.__arrayKernel = compiler.getKernel(array = True)
+        return self.__kernel
+
+    #Values of the functions at (x, y), as a list
+    def eval(self, x, y):
+        if self.__kernel is not None:
+            return list(self.__kernel(x, y))
+        results = evalNodeResults(self.__order, x, y, OPERATOR.getOperation)
+        return [results[id(root)] for root in self.__roots]
+
+    #Evaluate over arrays of x and y; see Function.evalArray.  Returns an
+    #array with one row per function, shape (len(self),) + broadcast shape
+    def evalArray(self, x, y):
+        if self.__arrayKernel is not None:
+            return evalBroadcast(self.__arrayKernel, (x, y), len(self.__roots))
+        return evalBroadcast(self.__evalNodes, (x, y), len(self.__roots))
+
+    #Values of the functions for arrays of x and y by walking the nodes
+    def __evalNodes(self, x, y):
+        results = evalNodeResults(self.__order, x, y, OPERATOR.getArrayOperation)
+        return [results[id(root)] for root in self.__roots]
+
+    #Evaluate over the grid spanned by xs and ys; shape
+    #(len(self), len(ys), len(xs))
+    def evalGrid(self, xs, ys):
+        requireNumpy()
+        xRow = numpy.asarray(xs, dtype = float).reshape(1, -1)
+        yCol = numpy.asarray(ys, dtype = float).reshape(-1, 1)
+        return self.evalArray(xRow, yCol)
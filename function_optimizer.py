@@ -0,0 +1,170 @@
+#Optimization pass that runs between Parser.getRoot() and evaluation.
+#  folds subtrees that only contain numbers, calls of named functions too
+#  removes identities (+0, -0, *1, /1, ^1) and replaces ^0 with 1
+#  collapses the numbers of a product chain (2x3 becomes 6*x)
+#  replaces bound variables with their values, so subtrees that only
+#  depend on them fold into numbers (see Function.bind)
+import math
+from function_parser import NodeTable, OPERATOR, countNodes, isConstant, postorder
+
+#Largest integer a product chain or an integer power may fold into; wider
+#integers would no longer convert to float when combined with x or y
+MAX_PRODUCT_BITS = 1023
+
+#base^n for integers base and n > 0, or None if it is wider than
+#MAX_PRODUCT_BITS.  Too wide powers like 9^9^9 are noticed before they
+#are computed, so they don't hang the pass
+def intPower(base, n):
+    if (abs(base).bit_length() - 1) * n > MAX_PRODUCT_BITS:
+        return None
+    result = base ** n
+    if result.bit_length() > MAX_PRODUCT_BITS:
+        return None
+    return result
+
+#Is the node the number num?
+def isNumber(node, num):
+    return isConstant(node) and node.getVal() == num
+
+#New nodes are built through a NodeTable, so subtrees that become
+#identical after simplifying are shared like the parser's nodes.
+#bindings maps variable names to the numbers they are replaced with
+class Optimizer:
+    def __init__(self, root, nodes = None, bindings = None):
+        if nodes is None:
+            nodes = NodeTable()
+        self.__nodes = nodes
+        self.__bindings = bindings or {}
+        self.__simplified = {}
+        self.__splits = {}
+        before = countNodes(root)
+        for node in postorder(root):
+            self.__simplified[id(node)] = self.__simplifyNode(node)
+        self.__root = self.__simplified[id(root)]
+        self.__removed = before - countNodes(self.__root)
+
+    def getRoot(self):
+        return self.__root
+
+    #Number of nodes the pass removed from the tree
+    def getRemoved(self):
+        return self.__removed
+
+    #Apply the operator to two numbers.  Returns None if the result should
+    #stay unfolded: errors like 0^-1 have to happen at evaluation time and
+    #complex results are not numbers the tree can hold
+    def __fold(self, op, left, right):
+        if op == '^' and type(left) == int and type(right) == int and right > 0:
+            return intPower(left, right)
+        try:
+            result = OPERATOR.getOperation(op)(left, right)
+        except (ArithmeticError, ValueError):
+            return None
+        if type(result) == int or type(result) == float:
+            return result
+        return None
+
+    #Apply a named function to a number.  Returns None if the result is
+    #not a finite number, like log(0), which is left for evaluation
+    def __foldCall(self, name, arg):
+        try:
+            result = OPERATOR.getOperation(name)(arg)
+        except (ArithmeticError, ValueError):
+            return None
+        if type(result) == float and math.isfinite(result):
+            return result
+        return None
+
+    #Split a simplified node into the number multiplied into its product
+    #chain and the product of the remaining factors, either one None
+    def __split(self, node):
+        if id(node) in self.__splits:
+            return self.__splits[id(node)]
+        if isConstant(node):
+            return (node.getVal(), None)
+        return (None, node)
+
+    #Product of two simplified factors.  Each factor carries at most one
+    #number in its chain, so when both do they are multiplied together and
+    #put in front of the remaining factors.  Keeping the split of every
+    #product node makes this constant time even for very long chains
+    def __collapseProduct(self, left, right):
+        leftConstant, leftRest = self.__split(left)
+        rightConstant, rightRest = self.__split(right)
+        if leftConstant is not None and rightConstant is not None:
+            product = leftConstant * rightConstant
+            #A product chain that outgrows floats stays as it was written
+            if type(product) == int and product.bit_length() > MAX_PRODUCT_BITS:
+                result = self.__nodes.getNode('*', left, right)
+                self.__splits[id(result)] = (None, result)
+                return result
+        if leftConstant is None or rightConstant is None:
+            result = self.__nodes.getNode('*', left, right)
+            if leftConstant is None and rightConstant is None:
+                self.__splits[id(result)] = (None, result)
+            elif leftConstant is None:
+                self.__splits[id(result)] = (rightConstant, self.__product(leftRest, rightRest))
+            else:
+                self.__splits[id(result)] = (leftConstant, self.__product(leftRest, rightRest))
+            return result
+        rest = self.__product(leftRest, rightRest)
+        if rest is None:
+            return self.__nodes.getNode(product)
+        if product == 1:
+            return rest
+        result = self.__nodes.getNode('*', self.__nodes.getNode(product), rest)
+        self.__splits[id(result)] = (product, rest)
+        return result
+
+    #Product node of two optional factors
+    def __product(self, left, right):
+        if left is None:
+            return right
+        if right is None:
+            return left
+        return self.__nodes.getNode('*', left, right)
+
+    #Simplified version of node.  Nodes are visited in postorder, so each
+    #distinct node is simplified once and its children already are
+    def __simplifyNode(self, node):
+        if node.getLeft() is None:
+            val = node.getVal()
+            if type(val) == str and val in self.__bindings:
+                return self.__nodes.getNode(self.__bindings[val])
+            return self.__nodes.getNode(val)
+        op = node.getVal()
+        left = self.__simplified[id(node.getLeft())]
+        if node.getRight() is None:
+            if isConstant(left):
+                folded = self.__foldCall(op, left.getVal())
+                if folded is not None:
+                    return self.__nodes.getNode(folded)
+            return self.__nodes.getNode(op, left)
+        right = self.__simplified[id(node.getRight())]
+        if isConstant(left) and isConstant(right):
+            folded = self.__fold(op, left.getVal(), right.getVal())
+            if folded is not None:
+                return self.__nodes.getNode(folded)
+        if op == '+':
+            if isNumber(right, 0):
+                return left
+            if isNumber(left, 0):
+                return right
+        elif op == '-':
+            if isNumber(right, 0):
+                return left
+        elif op == '*':
+            if isNumber(right, 1):
+                return left
+            if isNumber(left, 1):
+                return right
+            return self.__collapseProduct(left, right)
+        elif op == '/':
+            if isNumber(right, 1):
+                return left
+        elif op == '^':
+            if isNumber(right, 1):
+                return left
+            if isNumber(right, 0):
+                return self.__nodes.getNode(1)
+        return self.__nodes.getNode(op, left, right)
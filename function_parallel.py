@@ -0,0 +1,82 @@
+#Multi-core grid evaluation.  The grid is split into tiles that a process
+#pool evaluates in parallel.  Every worker gets the function source, its
+#variables and the axes once, when the pool starts, and writes its tiles straight into
+#an output array in shared memory, so no results are pickled
+import os
+from multiprocessing import Pool, shared_memory
+from function_parser import Function, requireNumpy, numpy
+
+DEFAULT_TILE_SIZE = 256
+
+#State of a worker process, set once by initWorker
+workerFunction = None
+workerXs = None
+workerYs = None
+workerMemory = None
+workerOutput = None
+workerError = None
+
+#Pool initializer: parse and compile the function and attach to the
+#shared output array.  An error is kept for evalTile to raise, since an
+#initializer that raises makes the pool start new workers forever.  A
+#worker may not know every function the parent registered, e.g. when
+#it was started with spawn
+def initWorker(source, variables, xs, ys, memoryName, dtype):
+    global workerFunction, workerXs, workerYs, workerMemory, workerOutput, workerError
+    try:
+        workerFunction = Function(source, variables = variables)
+        workerFunction.compile()
+        workerXs = xs
+        workerYs = ys
+        workerMemory = shared_memory.SharedMemory(name = memoryName)
+        workerOutput = numpy.ndarray((len(ys), len(xs)), dtype = dtype, buffer = workerMemory.buf)
+    except Exception as error:
+        workerError = error
+
+#Evaluate one tile (first row, end row, first column, end column)
+#into the shared output.  Returns the number of points
+def evalTile(tile):
+    if workerError is not None:
+        raise workerError
+    row0, row1, col0, col1 = tile
+    values = workerFunction.evalGrid(workerXs[col0:col1], workerYs[row0:row1])
+    workerOutput[row0:row1, col0:col1] = values
+    return values.size
+
+#Tiles of at most tileSize x tileSize covering a rows x cols grid
+def makeTiles(rows, cols, tileSize = DEFAULT_TILE_SIZE):
+    tiles = []
+    for row0 in range(0, rows, tileSize):
+        for col0 in range(0, cols, tileSize):
+            tiles.append((row0, min(row0 + tileSize, rows), col0, min(col0 + tileSize, cols)))
+    return tiles
+
+#Evaluate function over the grid spanned by xs and ys with a pool of
+#workers processes (all cores by default).  Returns an array of shape
+#(len(ys), len(xs)) like Function.evalGrid
+def evalGridParallel(function, xs, ys, workers = None, tileSize = DEFAULT_TILE_SIZE, dtype = 'float64'):
+    requireNumpy()
+    xs = numpy.asarray(xs, dtype = float)
+    ys = numpy.asarray(ys, dtype = float)
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if workers <= 1:
+        return function.evalGrid(xs, ys).astype(dtype)
+    #Check the source parses before any worker tries
+    Function(function.getSource(), False, variables = function.getVariables())
+    shape = (len(ys), len(xs))
+    size = max(1, shape[0] * shape[1] * numpy.dtype(dtype).itemsize)
+    memory = shared_memory.SharedMemory(create = True, size = size)
+    try:
+        output = numpy.ndarray(shape, dtype = dtype, buffer = memory.buf)
+        tiles = makeTiles(shape[0], shape[1], tileSize)
+        initArgs = (function.getSource(), function.getVariables(), xs, ys, memory.name, dtype)
+        with Pool(workers, initWorker, initArgs) as pool:
+            for count in pool.imap_unordered(evalTile, tiles):
+                pass
+        result = output.copy()
+        del output
+    finally:
+        memory.close()
+        memory.unlink()
+    return result
@@ -1,13 +1,19 @@
 #Parser for 2-D polynomial functions
 import operator
 import math
+import re
+import decimal
+try:
+    import numpy
+except ImportError:
+    numpy = None
 #Function tree
 #  root node
-#  members for x and y
+#  members for x and y, or the variables declared for the function
 
 #Tree node
 #  left and right children
-#  value (x, y, op, or number)
+#  value (variable name, op, function name, or number)
 class Node:
     def __init__(self, value, left = None, right = None):
         self.__value = value
@@ -22,32 +28,469 @@ class Node:
         
     def setRight(self, node):
         self.__right = node
-    
+
+    def getVal(self):
+        return self.__value
+
+    def getLeft(self):
+        return self.__left
+
+    def getRight(self):
+        return self.__right
+
+    #Evaluate the tree under this node.  The walk uses an explicit
+    #stack, so very deep trees do not hit the recursion limit, and
+    #nodes shared by several parents are computed once
     def eval(self, x, y):
-        val = self.__value
+        return evalNodes(postorder(self), x, y, OPERATOR.getOperation)
+
+    #Same walk as eval, but x and y are numpy arrays and
+    #every operator node is applied to the whole array at once
+    def evalArray(self, x, y):
+        return evalNodes(postorder(self), x, y, OPERATOR.getArrayOperation)
+
+#Hash-consing table for nodes.  Asking twice for a node with the same
+#value and the same children returns the same object, so structurally
+#identical subtrees become one shared node and the tree becomes a DAG.
+#Shared nodes must not be changed with setVal/setLeft/setRight
+class NodeTable:
+    def __init__(self):
+        self.__nodes = {}
+
+    def getNode(self, value, left = None, right = None):
+        #The type is part of the key so 2 and 2.0 stay different nodes
+        key = (type(value), value, id(left), id(right))
+        node = self.__nodes.get(key)
+        if node is None:
+            node = Node(value, left, right)
+            self.__nodes[key] = node
+        return node
+
+    def __len__(self):
+        return len(self.__nodes)
+
+#Distinct nodes reachable from root, children before their parents.
+#Uses an explicit stack instead of recursion
+def postorder(root):
+    return postorderRoots([root])
+
+#Postorder of the distinct nodes of several trees together.  Nodes
+#shared between the trees come once, before every tree that uses them
+def postorderRoots(roots):
+    order = []
+    done = set()
+    stack = [(root, False) for root in reversed(roots)]
+    while stack:
+        node, expanded = stack.pop()
+        if node is None or id(node) in done:
+            continue
+        if expanded:
+            done.add(id(node))
+            order.append(node)
+        else:
+            stack.append((node, True))
+            stack.append((node.getRight(), False))
+            stack.append((node.getLeft(), False))
+    return order
+
+#Count the distinct nodes reachable from root
+def countNodes(root):
+    return len(postorder(root))
+
+#Is the node a number?
+def isConstant(node):
+    valType = type(node.getVal())
+    return valType == int or valType == float
+
+#Evaluate nodes given in postorder; the last node is the root.
+#getOperation maps an operator character to the function applying it
+def evalNodes(order, x, y, getOperation):
+    return evalNodeResults(order, x, y, getOperation)[id(order[-1])]
+
+#Values of all nodes given in postorder, keyed by node id.  Only x and
+#y can be variables here; other variables need a Function, see makePlan
+def evalNodeResults(order, x, y, getOperation):
+    results = {}
+    for node in order:
+        val = node.getVal()
         valType = type(val)
         if valType == int or valType == float:
-            return val
+            result = val
         elif val == 'x':
-            return x
+            result = x
         elif val == 'y':
-            return y
+            result = y
+        elif node.getLeft() is None:
+            raise ValueError("unknown variable " + repr(val) + ": nodes evaluate x and y only; " +
+                "use Function(root = node, variables = [...]) for other variables")
+        elif node.getRight() is None:
+            #Named function of one argument
+            operation = getOperation(val)
+            result = operation(results[id(node.getLeft())])
         else:
-            leftResult = self.__left.eval(x,y)
-            rightResult = self.__right.eval(x,y)
-            operation = OPERATOR.getOperation(val)
-            return operation(leftResult,rightResult)
-            
+            leftResult = results[id(node.getLeft())]
+            rightResult = results[id(node.getRight())]
+            operation = getOperation(val)
+            result = operation(leftResult,rightResult)
+        results[id(node)] = result
+    return results
+
+#Kinds of the steps of an evaluation plan
+STEP_NUMBER = 0
+STEP_VARIABLE = 1
+STEP_CALL = 2
+STEP_OPERATOR = 3
+
+#Evaluation plan for nodes given in postorder.  Each step refers to an
+#input slot or to earlier steps by position: variable names are resolved
+#to the index of their slot in variables here, once, so evaluating the
+#plan looks nothing up by name or by node
+def makePlan(order, variables):
+    slots = {}
+    for i, name in enumerate(variables):
+        slots[name] = i
+    positions = {}
+    plan = []
+    for node in order:
+        val = node.getVal()
+        valType = type(val)
+        if valType == int or valType == float:
+            step = (STEP_NUMBER, val)
+        elif node.getLeft() is None:
+            if val not in slots:
+                raise ValueError("unknown variable " + repr(val) + "; the function takes " + ", ".join(variables))
+            step = (STEP_VARIABLE, slots[val])
+        elif node.getRight() is None:
+            step = (STEP_CALL, val, positions[id(node.getLeft())])
+        else:
+            step = (STEP_OPERATOR, val, positions[id(node.getLeft())], positions[id(node.getRight())])
+        positions[id(node)] = len(plan)
+        plan.append(step)
+    return plan
+
+#Value of the last step of plan, values holding the inputs in slot order
+def evalPlan(plan, values, getOperation):
+    results = []
+    append = results.append
+    for step in plan:
+        kind = step[0]
+        if kind == STEP_OPERATOR:
+            append(getOperation(step[1])(results[step[2]], results[step[3]]))
+        elif kind == STEP_VARIABLE:
+            append(values[step[1]])
+        elif kind == STEP_NUMBER:
+            append(step[1])
+        else:
+            append(getOperation(step[1])(results[step[2]]))
+    return results[-1]
+
+#Text for a number that the lexer reads back as the same value.
+#Negative numbers become a subtraction from 0 since there is no unary
+#minus, and floats are written without an exponent
+def formatNumber(val):
+    if type(val) == float:
+        if math.isnan(val):
+            return "(1/0-1/0)"
+        if math.isinf(val):
+            if val < 0:
+                return "(0-1/0)"
+            return "(1/0)"
+        text = format(decimal.Decimal(repr(abs(val))), 'f')
+        if '.' not in text:
+            text += ".0"
+    else:
+        text = str(abs(val))
+    if val < 0 or (type(val) == float and math.copysign(1, val) < 0):
+        return "(0-" + text + ")"
+    return text
+
+#Binding strength of a node as it is written by formatNode
+def formatPrecedence(node):
+    if node.getLeft() is None or node.getRight() is None:
+        return 4
+    return PRECEDENCE[node.getVal()]
+
+#Expression text for the tree under root, with parentheses only where
+#the grammar needs them and '*' always written out.  Pieces are collected
+#with an explicit stack and joined once, so deep trees take linear time
+def formatNode(root):
+    parts = []
+    stack = [root]
+    while stack:
+        item = stack.pop()
+        if type(item) == str:
+            parts.append(item)
+            continue
+        val = item.getVal()
+        valType = type(val)
+        if valType == int or valType == float:
+            parts.append(formatNumber(val))
+            continue
+        elif item.getLeft() is None:
+            parts.append(val)
+            continue
+        elif item.getRight() is None:
+            stack.extend([")", item.getLeft(), "(", val])
+            continue
+        precedence = PRECEDENCE[val]
+        leftPrecedence = formatPrecedence(item.getLeft())
+        rightPrecedence = formatPrecedence(item.getRight())
+        #Equal precedence needs parentheses on the right of left associative
+        #operators and on the left of the right associative '^'
+        if val in RIGHT_ASSOCIATIVE:
+            leftNeeds = leftPrecedence <= precedence
+            rightNeeds = rightPrecedence < precedence
+        else:
+            leftNeeds = leftPrecedence < precedence
+            rightNeeds = rightPrecedence <= precedence
+        #Pushed in reverse, the stack pops them left to right
+        if rightNeeds:
+            stack.extend([")", item.getRight(), "("])
+        else:
+            stack.append(item.getRight())
+        stack.append(val)
+        if leftNeeds:
+            stack.extend([")", item.getLeft(), "("])
+        else:
+            stack.append(item.getLeft())
+    return "".join(parts)
+
 class Function:
-    def __init__(self, strVal):
+    #optimize runs the constant folding and simplification pass
+    #from function_optimizer over the parsed tree.  If root is given
+    #that tree is used instead of parsing strVal.  variables are the
+    #names the function takes, in the order eval takes their values:
+    #  Function("z=rate*time+2offset", variables = ['rate', 'time', 'offset'])
+    #Without them a function takes x and y
+    def __init__(self, strVal = None, optimize = True, root = None, variables = None):
         self.__strFunc = strVal
-        tempParser = Parser(strVal)
-        self.__root = tempParser.getRoot()
-        
-    def eval(self, x, y):
-        return self.__root.eval(x,y)
+        self.__variables = checkVariables(variables)
+        if root is None:
+            tempParser = Parser(strVal, variables = variables)
+            root = tempParser.getRoot()
+        self.__root = root
+        self.__removedNodes = 0
+        if optimize:
+            from function_optimizer import Optimizer
+            optimizer = Optimizer(self.__root)
+            self.__root = optimizer.getRoot()
+            self.__removedNodes = optimizer.getRemoved()
+        self.__order = postorder(self.__root)
+        self.__plan = makePlan(self.__order, self.__variables)
+        self.__kernel = None
+        self.__arrayKernel = None
+        self.__derivatives = {}
+        self.__polynomial = None
+        self.__kernelPolynomial = False
+
+    def getRoot(self):
+        return self.__root
+
+    #Source string of the function, written from the tree
+    #if the function was not made from a string
+    def getSource(self):
+        if self.__strFunc is None:
+            self.__strFunc = "z=" + formatNode(self.__root)
+        return self.__strFunc
+
+    #Number of nodes the optimization pass removed
+    def getRemovedNodes(self):
+        return self.__removedNodes
+
+    #Names of the variables, in the order eval takes their values
+    def getVariables(self):
+        return self.__variables
+
+    #Raise a TypeError unless there is one value per variable
+    def __checkValues(self, values):
+        if len(values) != len(self.__variables):
+            raise TypeError("expected " + str(len(self.__variables)) + " values (" +
+                ", ".join(self.__variables) + "), got " + str(len(values)))
+
+    #Value of the function, one value per variable: eval(x, y) for a
+    #function of x and y.  The count is checked before calling a kernel
+    #too, so its generated argument names don't show up in the error
+    def eval(self, *values):
+        self.__checkValues(values)
+        if self.__kernel is not None:
+            return self.__kernel(*values)
+        return evalPlan(self.__plan, values, OPERATOR.getOperation)
+
+    #Generate a Python function for the tree so eval becomes a single
+    #call without walking the nodes.  Returns the scalar kernel, taking
+    #one value per variable like eval.
+    #With polynomial set, a function that is a polynomial in x and y is
+    #evaluated by Horner's scheme over its coefficients instead, which can
+    #round differently in the last bits; see function_polynomial
+    def compile(self, polynomial = False):
+        if self.__kernel is not None and self.__kernelPolynomial == polynomial:
+            return self.__kernel
+        self.__kernelPolynomial = polynomial
+        if polynomial and self.getPolynomial() is not None:
+            self.__kernel = self.__polynomial.getKernel()
+            self.__arrayKernel = self.__kernel
+        else:
+            from function_compiler import Compiler
+            compiler = Compiler(self.__root, self.__variables)
+            self.__kernel = compiler.getKernel()
+            if numpy is not None:
+                self.__arrayKernel = compiler.getKernel(array = True)
+        return self.__kernel
+
+    #Compile the function unless it already has a kernel, keeping the kind
+    #of kernel already chosen, so helpers that need a compiled function
+    #don't replace a polynomial kernel the caller asked for
+    def ensureCompiled(self):
+        if self.__kernel is None:
+            self.compile()
+        return self.__kernel
+
+    #Polynomial normal form of the function with its coefficients, or
+    #None if the function is not a polynomial in x and y
+    def getPolynomial(self):
+        if self.__variables != DEFAULT_VARIABLES:
+            return None
+        if self.__polynomial is None:
+            from function_polynomial import toPolynomial
+            self.__polynomial = toPolynomial(self.__root) or False
+        return self.__polynomial or None
+
+    #Instrumented wrapper that counts and times every node of this
+    #function; see function_profile
+    def profiled(self):
+        from function_profile import ProfiledFunction
+        return ProfiledFunction(self)
+
+    #New Function with variable fixed to value.  Every subtree that only
+    #depends on that variable is folded into a number, so sweeping the
+    #other variables does not compute it again.  The new function still
+    #takes every variable and ignores the bound one
+    def bind(self, variable, value):
+        if variable not in self.__variables:
+            raise ValueError("cannot bind " + repr(variable) + ": the function takes " + ", ".join(self.__variables))
+        if type(value) != int:
+            value = float(value)
+        from function_optimizer import Optimizer
+        root = Optimizer(self.__root, bindings = {variable : value}).getRoot()
+        return Function(None, False, root, self.__variables)
+
+    #Partial derivative with respect to variable as a new, simplified
+    #Function of the same variables that supports every evaluation mode
+    def derivative(self, variable):
+        if variable not in self.__variables:
+            raise ValueError("cannot differentiate with respect to " + repr(variable) +
+                ": the function takes " + ", ".join(self.__variables))
+        if variable not in self.__derivatives:
+            from function_derivative import Differentiator
+            root = Differentiator(self.__root, variable).getRoot()
+            self.__derivatives[variable] = Function(root = root, variables = self.__variables)
+        return self.__derivatives[variable]
+
+    #Partial derivatives with respect to every variable, (d/dx, d/dy)
+    #for a function of x and y
+    def gradient(self):
+        return tuple(self.derivative(variable) for variable in self.__variables)
+
+    #Value of the gradient at one value per variable
+    def evalGradient(self, *values):
+        return tuple(partial.eval(*values) for partial in self.gradient())
+
+    #Lower and upper bound of the function over a box given by one (lo, hi)
+    #pair or number per variable; see function_interval
+    def evalInterval(self, *values):
+        from function_interval import evalIntervalPlan
+        self.__checkValues(values)
+        return evalIntervalPlan(self.__plan, values)
+
+    #Evaluate over arrays of values, one per variable (broadcast against
+    #each other), with one walk of the tree.  Returns a float64 array of the
+    #broadcast shape.  Negative bases with fractional exponents give nan
+    #instead of a complex number
+    def evalArray(self, *values):
+        self.__checkValues(values)
+        if self.__arrayKernel is not None:
+            return evalBroadcast(self.__arrayKernel, values)
+        return evalBroadcast(lambda *arrays: evalPlan(self.__plan, arrays, OPERATOR.getArrayOperation), values)
+
+    #Evaluate over a table of equal-length columns: a dict of arrays or
+    #lists by variable name, a numpy structured array, or anything else
+    #that gives a column for a name.  Each column is converted once and
+    #the whole table is evaluated as one batch.  Returns one value per row
+    def evalColumns(self, columns):
+        requireNumpy()
+        arrays = []
+        for name in self.__variables:
+            try:
+                column = columns[name]
+            except (KeyError, ValueError, IndexError):
+                raise ValueError("no column for variable " + repr(name))
+            arrays.append(numpy.asarray(column, dtype=float))
+        lengths = set(array.shape for array in arrays)
+        if len(lengths) != 1 or len(arrays[0].shape) != 1:
+            raise ValueError("columns must be 1-D and of the same length")
+        return self.evalArray(*arrays)
+
+    #Evaluate a function of two variables over the grid spanned by the
+    #1-D arrays xs (first variable) and ys (second variable).
+    #Result has shape (len(ys), len(xs)) like numpy.meshgrid(xs, ys),
+    #but the grid itself is never materialized
+    def evalGrid(self, xs, ys):
+        requireNumpy()
+        xRow = numpy.asarray(xs, dtype=float).reshape(1, -1)
+        yCol = numpy.asarray(ys, dtype=float).reshape(-1, 1)
+        return self.evalArray(xRow, yCol)
+
+    #evalGrid for grids too large for memory: tiles of tileSize rows and
+    #columns are written into a memory-mapped .npy file at path, and an
+    #interrupted run is resumed; see function_memmap
+    def evalGridToFile(self, xs, ys, path, tileSize = 1024, dtype = 'float64', resume = True, progress = None):
+        from function_memmap import evalGridToFile
+        return evalGridToFile(self, xs, ys, path, tileSize, dtype, resume, progress)
+
+    #Solve function = level for variable at many points at once, lo and hi
+    #bracketing the root and fixed holding the other variable's values (a
+    #dict by name for more variables); see function_solver
+    def solve(self, level, lo, hi, fixed, variable = 'y', tolerance = 1e-12, maxIterations = 100):
+        from function_solver import solve
+        return solve(self, level, lo, hi, fixed, variable, tolerance, maxIterations)
+
+#Raise an ImportError if numpy is not available for batch evaluation
+def requireNumpy():
+    if numpy is None:
+        raise ImportError("numpy is required for batch evaluation")
+
+#Batch evaluation shared by the evalArray methods: run is called with the
+#values as float arrays, without numpy warnings for nan and inf, and its
+#result is copied into a new float array of the broadcast shape of the
+#values.  With rows set, run returns one result per row and the array
+#has shape (rows,) + broadcast shape
+def evalBroadcast(run, values, rows = None):
+    requireNumpy()
+    arrays = [numpy.asarray(value, dtype = float) for value in values]
+    shape = numpy.broadcast(*arrays).shape
+    with numpy.errstate(all = 'ignore'):
+        result = run(*arrays)
+    if rows is None:
+        return numpy.array(numpy.broadcast_to(result, shape), dtype = float)
+    output = numpy.empty((rows,) + shape)
+    for i, value in enumerate(result):
+        output[i] = value
+    return output
             
 class Type:    
+    #Types hold no per-token state, so every derived class has one
+    #shared instance: INT() always returns the same object
+    __instances = {}
+
+    def __new__(cls, *args):
+        if cls is Type:
+            return object.__new__(cls)
+        instance = Type.__instances.get(cls)
+        if instance is None:
+            instance = object.__new__(cls)
+            Type.__instances[cls] = instance
+        return instance
+
     def __init__(self, type, valids = []):
         self.__type = type
         self.__valids = valids
@@ -56,6 +499,9 @@ class Type:
     #token of this type
     def valid(self, charSeq):
         return charSeq in self.__valids
+
+    def getValids(self):
+        return self.__valids
     
     def __str__(self):
         return self.__type
@@ -91,9 +537,24 @@ class OPERATOR(Type):
             else:
                 return math.inf
         return x / y
-		
-	#Add special function calculator here for sin, cos, log
-        
+
+    #Elementwise version of __realDiv: division by zero gives
+    #-inf where x < 0 and inf everywhere else
+    def __arrayDiv(x,y):
+        if not (isinstance(x, numpy.ndarray) or isinstance(y, numpy.ndarray)):
+            return OPERATOR.__realDiv(x,y)
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            result = numpy.true_divide(x, y)
+        infinity = numpy.where(x < 0, -math.inf, math.inf)
+        return numpy.where(y == 0.0, infinity, result)
+
+    #Elementwise power on float64, so a negative base with a fractional
+    #exponent gives nan and overflow gives inf even where both operands
+    #are numbers (a constant subtree the optimizer did not fold)
+    def __arrayPow(x,y):
+        with numpy.errstate(all='ignore'):
+            return numpy.power(numpy.asarray(x, dtype=float), numpy.asarray(y, dtype=float))
+
     __table = {
         '+' : operator.add,
         '-' : operator.sub,
@@ -101,10 +562,26 @@ class OPERATOR(Type):
         '/' : __realDiv,
         '^' : operator.pow
     }
+    __arrayTable = {
+        '+' : operator.add,
+        '-' : operator.sub,
+        '*' : operator.mul,
+        '/' : __arrayDiv,
+        '^' : __arrayPow
+    }
     def __init__(self):
         Type.__init__(self, 'Operator', ['+', '-', '*', '/', '^'])
+    #Operators, or the named functions of FUNCTIONS by name
     def getOperation(opChar):
-        return OPERATOR.__table[opChar]
+        operation = OPERATOR.__table.get(opChar)
+        if operation is None:
+            return FUNCTIONS[opChar].getScalar()
+        return operation
+    def getArrayOperation(opChar):
+        operation = OPERATOR.__arrayTable.get(opChar)
+        if operation is None:
+            return FUNCTIONS[opChar].getArray()
+        return operation
         
 
 class PARENTHESIS(Type):
@@ -121,9 +598,16 @@ class Invalid(Type):
     def __init__(self):
         Type.__init__(self, 'Invalid')
 
+#Derived class for the names of registered functions, like sin
+class FUNCTION(Type):
+    def __init__(self):
+        Type.__init__(self, 'FunctionName', FUNCTIONS)
+
 #Token class that stores a token type object
 #and the value of the token        
 class Token:
+    __slots__ = ('__type', '__val')
+
     def __init__(self, type, val):
         self.__type = type
         self.__val = val
@@ -142,111 +626,197 @@ class Token:
     def __repr__(self):
         return self.__str__()
 
+#Splits the input into token texts in one pass: a number (digits, then
+#optionally a '.' and more digits), the name of a registered function
+#followed by '(', a declared variable name longer than one character or
+#any other single character.  Spaces separate tokens and make none
+#themselves.  Rebuilt by registerFunction
+def buildTokenPattern(names, variables = ()):
+    alternatives = [(name, re.escape(name) + r'(?= *\()') for name in names]
+    alternatives += [(name, re.escape(name)) for name in variables if len(name) > 1]
+    #Longer names first, so sinh( is not read as sin
+    alternatives.sort(key = lambda alternative: len(alternative[0]), reverse = True)
+    patterns = [pattern for name, pattern in alternatives]
+    return re.compile('|'.join([r'[0-9]+(?:\.[0-9]*)?'] + patterns + [r'[^ ]']))
+
+TOKEN_PATTERN = buildTokenPattern([])
+
+#Token type of every single character token.  Characters that
+#are not listed make an invalid token
+CHAR_TYPES = {}
+for char in 'abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ':
+    CHAR_TYPES[char] = ID()
+for char in '0123456789':
+    CHAR_TYPES[char] = INT()
+for tokenType in [ASSIGNMENT(), OPERATOR(), PARENTHESIS(), EOI()]:
+    for char in tokenType.getValids():
+        CHAR_TYPES[char] = tokenType
+
+#Token type of a text matched by TOKEN_PATTERN that is not a single
+#character in CHAR_TYPES.  A number ending in '.' is invalid
+def getTokenType(text):
+    if '0' <= text[0] <= '9':
+        if text[-1] == '.':
+            return Invalid()
+        elif '.' in text:
+            return FLOAT()
+        return INT()
+    elif text in FUNCTIONS:
+        return FUNCTION()
+    return Invalid()
+
+#A named function of one argument.  scalar works on numbers and array on
+#numpy arrays.  derivative is the derivative as expression text in x,
+#e.g. "cos(x)" for sin, and interval maps a (lo, hi) interval of the
+#argument to bounds of the result; see function_interval
+class NamedFunction:
+    def __init__(self, name, scalar, array = None, derivative = None, interval = None):
+        self.__name = name
+        self.__scalar = scalar
+        self.__array = array
+        self.__derivative = derivative
+        self.__interval = interval
+
+    def getName(self):
+        return self.__name
+
+    def getScalar(self):
+        return self.__scalar
+
+    def getArray(self):
+        return self.__array
+
+    def getDerivative(self):
+        return self.__derivative
+
+    def getInterval(self):
+        return self.__interval
+
+#Registered functions by name
+FUNCTIONS = {}
+
+NAME_PATTERN = re.compile(r'[A-Za-z_][A-Za-z0-9_]+$')
+
+#Make name(...) usable in functions parsed from now on.  Names have at
+#least two characters, since single letters are variables.  Without an
+#array version the scalar one is vectorized, which is slow but works
+def registerFunction(name, scalar, array = None, derivative = None, interval = None):
+    global TOKEN_PATTERN
+    if not NAME_PATTERN.match(name):
+        raise ValueError("invalid function name " + repr(name) + ": use two or more letters, digits or _")
+    if array is None and numpy is not None:
+        array = numpy.vectorize(scalar, otypes = [float])
+    FUNCTIONS[name] = NamedFunction(name, scalar, array, derivative, interval)
+    TOKEN_PATTERN = buildTokenPattern(FUNCTIONS.keys())
+
+#The registered function called name
+def getNamedFunction(name):
+    return FUNCTIONS[name]
+
+#Scalar versions of the built-in functions give nan and infinities
+#where math raises, like the array versions do.  Complex arguments,
+#from a negative base to a fractional power, give nan too
+def realSin(x):
+    if isinstance(x, complex) or not math.isfinite(x):
+        return math.nan
+    return math.sin(x)
+
+def realCos(x):
+    if isinstance(x, complex) or not math.isfinite(x):
+        return math.nan
+    return math.cos(x)
+
+def realLog(x):
+    if isinstance(x, complex):
+        return math.nan
+    elif x > 0:
+        return math.log(x)
+    elif x == 0:
+        return -math.inf
+    return math.nan
+
+def realExp(x):
+    if isinstance(x, complex):
+        return math.nan
+    try:
+        return math.exp(x)
+    except OverflowError:
+        return math.inf
+
+def realSqrt(x):
+    if isinstance(x, complex):
+        return math.nan
+    elif x >= 0:
+        return math.sqrt(x)
+    return math.nan
+
+#Interval of the built-in function name, from function_interval's
+#FUNCTION_INTERVALS.  It is looked up when first used, so the parser
+#does not import function_interval
+def builtinInterval(name):
+    def interval(a):
+        from function_interval import FUNCTION_INTERVALS
+        return FUNCTION_INTERVALS[name](a)
+    return interval
+
+registerFunction('sin', realSin, numpy.sin if numpy else None, "cos(x)", builtinInterval('sin'))
+registerFunction('cos', realCos, numpy.cos if numpy else None, "0-sin(x)", builtinInterval('cos'))
+registerFunction('log', realLog, numpy.log if numpy else None, "1/x", builtinInterval('log'))
+registerFunction('exp', realExp, numpy.exp if numpy else None, "exp(x)", builtinInterval('exp'))
+registerFunction('sqrt', realSqrt, numpy.sqrt if numpy else None, "0.5/sqrt(x)", builtinInterval('sqrt'))
+
+#Variables of a function that does not declare any
+DEFAULT_VARIABLES = ['x', 'y']
+
+VARIABLE_PATTERN = re.compile(r'[A-Za-z_][A-Za-z0-9_]*$')
+
+#Declared variables as a list, DEFAULT_VARIABLES if there are none.
+#Names are letters, digits and _, and cannot be z (the result), the
+#name of a registered function or used twice
+def checkVariables(variables):
+    if variables is None:
+        return DEFAULT_VARIABLES
+    variables = list(variables)
+    if len(variables) == 0:
+        raise ValueError("a function needs at least one variable")
+    for name in variables:
+        if type(name) != str or not VARIABLE_PATTERN.match(name):
+            raise ValueError("invalid variable name " + repr(name) + ": use letters, digits or _")
+        if name == 'z' or name in FUNCTIONS:
+            raise ValueError("variable name " + repr(name) + " is taken")
+    if len(set(variables)) != len(variables):
+        raise ValueError("variable names must be different")
+    return variables
+
 #Class that performs lexical analysis
-#by turning a character sequence to a token sequence        
+#by turning a character sequence to a token sequence.
+#The whole input is tokenized in one pass when the lexer is made.
+#Declared variables are read as one Id token each, the longest name
+#first, so with rate and time declared "2rate time" is 2*rate*time
 class Lexer:
-    def __init__(self, s):
-        self.__s = s
-        self.__len = len(s)
+    def __init__(self, s, variables = None):
+        charTypes = CHAR_TYPES
+        pattern = TOKEN_PATTERN
+        if variables is not None:
+            charTypes = dict(CHAR_TYPES)
+            for name in variables:
+                charTypes[name] = ID()
+            pattern = buildTokenPattern(FUNCTIONS.keys(), variables)
+        self.__tokens = [Token(charTypes.get(text) or getTokenType(text), text)
+            for text in pattern.findall(s)]
         self.__index = 0
-        self.__eoi = False
-        self.__singleCharTypes = [
-            ASSIGNMENT(),
-            OPERATOR(),
-            PARENTHESIS(),
-            EOI()
-        ]
-    
-    #Get current char in stream    
-    def __getCurrentChar(self):
-        return self.__s[self.__index]
-    
-    #Is current character a letter?    
-    def __isCharLetter(self):
-        if self.__endStream():
-            return False
-        curChar = self.__getCurrentChar()
-        return ('A' <= curChar <= 'Z') or ('a' <= curChar <= 'z')
-    
-    #Is current character a digit?
-    def __isCharDigit(self):
-        if self.__endStream():
-            return False
-        curChar = self.__getCurrentChar()
-        return '0' <= curChar <= '9'
-    
-    #Is current character a space?    
-    def __isCharSpace(self):
-        return self.__getCurrentChar() == ' '
-    
-    #Did we reach the end of the character stream?
-    def __endStream(self):
-        return self.__index >= self.__len
-    
-    #Go to next character in the stream
-    def __toNextChar(self):
-        self.__index += 1
-   
-    #Get a sequence of digits
-    def __getNumber(self):
-        result = ''
-        while (self.__isCharDigit()):
-            result += self.__getCurrentChar()
-            self.__toNextChar()
-        return result
-    
-    #Get a sequence of letters and digits
-    def __getAlphaNum(self):
-        result = ''
-        while (self.__isCharLetter() or self.__isCharDigit()):
-            result += self.__getCurrentChar()
-            self.__toNextChar()
-        return result
-        
+        self.__eoi = '$' in s
+
+    #Get every token of the input
+    def getTokens(self):
+        return self.__tokens
+
     #Get next token from character stream
     def nextToken(self):
-        while not self.__endStream():
-            
-            #Check if character is operator, comma, or EOI
-            current = self.__getCurrentChar()
-            for tokenType in self.__singleCharTypes:
-                if tokenType.valid(current): 
-                    if isinstance(tokenType, EOI):
-                        self.__eoi = True
-                    self.__toNextChar()
-                    return Token(tokenType, current)
-            
-            #Get an integer or float if
-            #character is a digit
-            if self.__isCharDigit():
-                leftDigits = self.__getNumber()
-                current = self.__getCurrentChar()
-                if (current == '.'):
-                    leftDigits += current
-                    self.__toNextChar()
-                    if self.__isCharDigit():
-                        rightDigits = self.__getNumber()
-                        floatStr = leftDigits + rightDigits
-                        return Token(FLOAT(), floatStr)
-                    else:
-                        return Token(Invalid(), leftDigits)
-                else:
-                    return Token(INT(), leftDigits)
-            #Get an identifier or keyword
-            #if character is a letter
-            elif self.__isCharLetter():
-                charSeq = self.__getCurrentChar()
-                self.__toNextChar()
-                return Token(ID(), charSeq)
-            #Skip to next character if it is a space
-            elif self.__isCharSpace():
-                self.__toNextChar()
-            #Mark the character as invalid if it doesn't match
-            #any of the above
-            else:
-                current = self.__getCurrentChar()
-                self.__toNextChar()
-                return Token(Invalid(), current)
+        if self.__index < len(self.__tokens):
+            token = self.__tokens[self.__index]
+            self.__index += 1
+            return token
         #Make an invalid token if eoi is not reached by
         #the end of the character stream
         if not self.__eoi:
@@ -254,19 +824,48 @@ class Lexer:
         else:
             return None
 
+#Binding strength of each operator for the parser, higher binds tighter
+PRECEDENCE = {
+    '+' : 1,
+    '-' : 1,
+    '*' : 2,
+    '/' : 2,
+    '^' : 3
+}
+RIGHT_ASSOCIATIVE = ['^']
+
+#Raised by the parser for input that is not a function.  expected and
+#saw are the names of the token types, e.g. 'Parenthesis' and 'EOI'
+class FunctionSyntaxError(ValueError):
+    def __init__(self, expected, saw):
+        ValueError.__init__(self, "Syntax error: expecting " + expected + "; saw " + saw)
+        self.__expected = expected
+        self.__saw = saw
+
+    #Pickle with both arguments, so the error can come back from a
+    #worker process
+    def __reduce__(self):
+        return (FunctionSyntaxError, (self.__expected, self.__saw))
+
+    def getExpected(self):
+        return self.__expected
+
+    def getSaw(self):
+        return self.__saw
+
 #Function parser for polynomials and exponentials
 class Parser:
-    #Take an inpuuted line and append $ for EOI
-    def __init__(self, s):
-        self.__lexer = Lexer(s + "$")
+    #Take an inpuuted line and append $ for EOI.  A lexer already
+    #made for the line (with the $) can be passed in instead.  Only
+    #the names in variables (x and y by default) are accepted as values
+    def __init__(self, s, lexer = None, variables = None):
+        self.__variables = checkVariables(variables)
+        if lexer is None:
+            lexer = Lexer(s + "$", variables)
+        self.__lexer = lexer
         self.__token = self.__lexer.nextToken()
+        self.__nodes = NodeTable()
         
-    def __printXML(self, level, value, header):
-        tail = ""
-        if not header:
-            tail += "/"
-        print(('\t' * level) + "<" + tail + value + ">")
-    
     #Store the next token outputted by the lexer into the private member
     def __getNextToken(self):
         self.__token = self.__lexer.nextToken()
@@ -290,21 +889,20 @@ class Parser:
             validValue = self.__token.getVal() == value
         return validValue and isinstance(self.__token.getType(), tokenType)
     
-    #Print out the error by showing what type of token the parser was expecting
-    #vs what it saw.  Then, exit so the parser doesn't keep parsing after syntax error.
-    def __printError(self, tokenType):
+    #Raise the error showing what type of token the parser was expecting
+    #vs what it saw, so the parser doesn't keep parsing after syntax error.
+    def __syntaxError(self, tokenType):
         tokenTypeObj = tokenType()
-        print("Syntax error: expecting " + str(tokenTypeObj) + "; saw " + str(self.__token.getType()) + '\n')
-        exit()
+        raise FunctionSyntaxError(str(tokenTypeObj), str(self.__token.getType()))
     
-    #Check if the token matches the type inputted and print it out if it does.
-    #Otherwise, print the syntax error message and exit.  If keyword has length > 0
+    #Check if the token matches the type inputted and move past it if it does.
+    #Otherwise, raise a FunctionSyntaxError.  If keyword has length > 0
     #make sure the token matches the keyword inputted
     def __expectToken(self, level, tokenType, keyword = ""):
         if (self.__matches(tokenType, keyword)):
             self.__getNextToken()
         else:
-            self.__printError(tokenType)
+            self.__syntaxError(tokenType)
             
     def __getCurrentTokenVal(self, tokenType, keyword = ""):
         if (self.__matches(tokenType, keyword)):
@@ -312,79 +910,105 @@ class Parser:
             self.__getNextToken()
             return val
         else:
-            self.__printError(tokenType)
-            return None
-    
-    #DONE
-    def __expression(self):
-        currentNode = self.__term()
-        while self.__matchesVals(OPERATOR, ['+', '-']):
-            newNode = Node(self.__getCurrentTokenVal(OPERATOR))
-            newNode.setLeft(currentNode)
-            newNode.setRight(self.__term())
-            currentNode = newNode
-        return currentNode
+            self.__syntaxError(tokenType)
     
-    def __term(self):
-        currentNode = self.__factor()
-        while not (self.__matchesVals(OPERATOR, ['+','-']) 
-            or self.__matches(PARENTHESIS, ')') or self.__matches(EOI)):
-            newNode = Node('*')
-            if (self.__matches(OPERATOR)):
-                newNode.setVal(self.__getCurrentTokenVal(OPERATOR))
-            newNode.setLeft(currentNode)
-            newNode.setRight(self.__factor())
-            currentNode = newNode
-        return currentNode
-            
-    def __factor(self):
-        currentNode = self.__pow()
-        if self.__matches(OPERATOR, "^"):
-            newNode = Node(self.__getCurrentTokenVal(OPERATOR, '^'))
-            newNode.setLeft(currentNode)
-            newNode.setRight(self.__factor())
-            currentNode = newNode
-        return currentNode
-        
-    def __pow(self):
-	
-		#Add sin, cos, log function possibility here
-	
-        if self.__matches(PARENTHESIS, '('):
-            self.__getCurrentTokenVal(PARENTHESIS, '(')
-            node = self.__expression()
-            self.__getCurrentTokenVal(PARENTHESIS, ')')
-            return node
+    #Push an operator after popping the ones on the stack that have to be
+    #applied first.  '^' is right associative so it pops nothing
+    def __pushOperator(self, operands, operators, op):
+        if op in RIGHT_ASSOCIATIVE:
+            self.__reduce(operands, operators, PRECEDENCE[op] + 1)
         else:
-            return self.__value()
+            self.__reduce(operands, operators, PRECEDENCE[op])
+        operators.append(op)
+
+    #Pop operators down to the nearest '(' while they have at least the
+    #given precedence, combining the top two operands into a node each time
+    def __reduce(self, operands, operators, precedence):
+        while len(operators) > 0 and operators[-1] != '(':
+            if PRECEDENCE[operators[-1]] < precedence:
+                break
+            op = operators.pop()
+            right = operands.pop()
+            left = operands.pop()
+            operands.append(self.__nodes.getNode(op, left, right))
+
+    #Shunting-yard parse of an expression with explicit operand and operator
+    #stacks, so nesting depth and power chains never grow the Python stack.
+    #It builds the same trees as the recursive grammar it replaced:
+    #  expression = term (('+' | '-') term)*
+    #  term       = factor (['*' | '/'] factor)*     no operator means '*'
+    #  factor     = pow ['^' factor]
+    #  pow        = [name] '(' expression ')' | value
+    #An unmatched ')' ends the expression, as it did before
+    def __expression(self):
+        operands = []
+        operators = []
+        depth = 0
+        expectOperand = True
+        while True:
+            if expectOperand:
+                if self.__matches(FUNCTION):
+                    #The name waits under its '(' until the ')'
+                    operators.append(self.__getCurrentTokenVal(FUNCTION))
+                    self.__getCurrentTokenVal(PARENTHESIS, '(')
+                    operators.append('(')
+                    depth += 1
+                elif self.__matches(PARENTHESIS, '('):
+                    self.__getCurrentTokenVal(PARENTHESIS, '(')
+                    operators.append('(')
+                    depth += 1
+                else:
+                    operands.append(self.__value())
+                    expectOperand = False
+            elif self.__matches(OPERATOR):
+                self.__pushOperator(operands, operators, self.__getCurrentTokenVal(OPERATOR))
+                expectOperand = True
+            elif self.__matches(PARENTHESIS, ')'):
+                if depth == 0:
+                    break
+                self.__getCurrentTokenVal(PARENTHESIS, ')')
+                self.__reduce(operands, operators, 0)
+                operators.pop()
+                depth -= 1
+                if len(operators) > 0 and operators[-1] in FUNCTIONS:
+                    name = operators.pop()
+                    operands.append(self.__nodes.getNode(name, operands.pop()))
+            elif self.__matches(EOI):
+                break
+            else:
+                self.__pushOperator(operands, operators, '*')
+                expectOperand = True
+        if depth > 0:
+            self.__syntaxError(PARENTHESIS)
+        self.__reduce(operands, operators, 0)
+        return operands[0]
         
     def __value(self):
-        if self.__matchesVals(ID, ['x', 'y']):            
-            return Node(self.__getCurrentTokenVal(ID))
+        if self.__matchesVals(ID, self.__variables):
+            return self.__nodes.getNode(self.__getCurrentTokenVal(ID))
         elif self.__matches(FLOAT):
             floatVal = float(self.__getCurrentTokenVal(FLOAT))
-            return Node(floatVal)
+            return self.__nodes.getNode(floatVal)
         else:
             intVal = int(self.__getCurrentTokenVal(INT))
-            return Node(intVal)
+            return self.__nodes.getNode(intVal)
             
     def getRoot(self):
         self.__getCurrentTokenVal(ID, 'z')
         self.__getCurrentTokenVal(ASSIGNMENT) 
         root = self.__expression()
+        #Anything left after the expression, like the ")+3" of "z=x)+3",
+        #is a syntax error rather than silently dropped
+        self.__expectToken(0, EOI)
         return root
             
-a = Lexer("z=x^2+2y" + "$")
-b = a.nextToken()
-while not isinstance(b.getType(), EOI):
-    print(b)
+#Demo of the lexer, only when run as a script so importing
+#the module prints nothing
+if __name__ == '__main__':
+    a = Lexer("z=x^2+2y" + "$")
     b = a.nextToken()
-    
-c = Parser("z=3x^y^4-2y^3+3.2/(xy^7)")
-
-#TODO:
-  #Fix Lexer to parse sin, cos, log
-  #Make new types for function strings sin, cos, log
-  #Fix Parser to include new type of functions (in pow function)
-  #Add evaluation option for functions
-        
\ No newline at end of file
+    while not isinstance(b.getType(), EOI):
+        print(b)
+        b = a.nextToken()
+        
+    c = Parser("z=3x^y^4-2y^3+3.2/(xy^7)")
@@ -0,0 +1,212 @@
+#Polynomial normal form of function trees.  A tree built only from x, y,
+#numbers, + - *, division by a number and powers with a non-negative
+#integer exponent is a polynomial in x and y.  Its coefficients are kept
+#as a sparse dict {(i, j) : c} for the terms c * x^i * y^j, which is the
+#same for every way of writing the polynomial, and it is evaluated with
+#nested Horner's scheme: one multiply and add per coefficient.
+#  polynomial = toPolynomial(Parser("z=(x+y)^2").getRoot())
+#  polynomial.getCoefficients()    {(2, 0): 1, (1, 1): 2, (0, 2): 1}
+#Horner's scheme rounds differently than the tree, so results can differ
+#in the last bits, and it gives inf where the tree would overflow
+import math
+from function_parser import postorder, evalBroadcast
+from function_optimizer import intPower
+
+#Highest power of x or y a polynomial may have, so that something like
+#(x+y)^1000 is not expanded into a huge number of terms
+MAX_DEGREE = 64
+
+#Sum of two coefficient dicts, terms that cancel are left out
+def addTerms(a, b, sign = 1):
+    result = dict(a)
+    for power, c in b.items():
+        c = result.get(power, 0) + sign * c
+        if c == 0:
+            result.pop(power, None)
+        else:
+            result[power] = c
+    return result
+
+#Highest powers of x and y in a coefficient dict
+def degrees(terms):
+    maxI = 0
+    maxJ = 0
+    for i, j in terms:
+        maxI = max(maxI, i)
+        maxJ = max(maxJ, j)
+    return (maxI, maxJ)
+
+#Product of two coefficient dicts, None if it is of too high a degree
+def multiplyTerms(a, b):
+    aI, aJ = degrees(a)
+    bI, bJ = degrees(b)
+    if aI + bI > MAX_DEGREE or aJ + bJ > MAX_DEGREE:
+        return None
+    result = {}
+    for (i1, j1), c1 in a.items():
+        for (i2, j2), c2 in b.items():
+            power = (i1 + i2, j1 + j2)
+            result[power] = result.get(power, 0) + c1 * c2
+    return dict((power, c) for power, c in result.items() if c != 0)
+
+#a to the non-negative integer power n by repeated squaring
+def powerTerms(a, n):
+    constant = constantOf(a)
+    if constant is not None and n > MAX_DEGREE:
+        #Powers of numbers are not limited by degree; keep them small
+        if type(constant) == int:
+            result = intPower(constant, n)
+            if result is None:
+                return None
+        else:
+            try:
+                result = constant ** n
+            except OverflowError:
+                return None
+        return {(0, 0) : result} if result != 0 else {}
+    aI, aJ = degrees(a)
+    if aI * n > MAX_DEGREE or aJ * n > MAX_DEGREE:
+        return None
+    result = {(0, 0) : 1}
+    while n > 0:
+        if n % 2 == 1:
+            result = multiplyTerms(result, a)
+        n //= 2
+        if n > 0:
+            a = multiplyTerms(a, a)
+    return result
+
+#Number a constant coefficient dict stands for, or None if it is not one
+def constantOf(terms):
+    if len(terms) == 0:
+        return 0
+    if len(terms) == 1 and (0, 0) in terms:
+        return terms[(0, 0)]
+    return None
+
+#Coefficient dict of a node whose children already have one
+def nodeTerms(node, terms):
+    val = node.getVal()
+    valType = type(val)
+    if valType == int or valType == float:
+        if not math.isfinite(val):
+            return None
+        return {(0, 0) : val} if val != 0 else {}
+    elif val == 'x':
+        return {(1, 0) : 1}
+    elif val == 'y':
+        return {(0, 1) : 1}
+    elif node.getRight() is None:
+        #Named functions are not polynomials
+        return None
+    left = terms[id(node.getLeft())]
+    right = terms[id(node.getRight())]
+    if left is None or right is None:
+        return None
+    if val == '+':
+        return addTerms(left, right)
+    elif val == '-':
+        return addTerms(left, right, -1)
+    elif val == '*':
+        return multiplyTerms(left, right)
+    elif val == '/':
+        divisor = constantOf(right)
+        if divisor is None or divisor == 0:
+            return None
+        return dict((power, c / divisor) for power, c in left.items())
+    elif val == '^':
+        exponent = constantOf(right)
+        if exponent is None or exponent < 0 or exponent != int(exponent):
+            return None
+        return powerTerms(left, int(exponent))
+    return None
+
+#Polynomial of the tree under root, or None if the tree is not one
+def toPolynomial(root):
+    terms = {}
+    for node in postorder(root):
+        terms[id(node)] = nodeTerms(node, terms)
+    result = terms[id(root)]
+    if result is None:
+        return None
+    for c in result.values():
+        try:
+            if not math.isfinite(float(c)):
+                return None
+        except OverflowError:
+            return None
+    return Polynomial(result)
+
+class Polynomial:
+    def __init__(self, coefficients):
+        self.__coefficients = dict((power, c) for power, c in coefficients.items() if c != 0)
+        self.__kernel = None
+
+    #Sparse coefficients {(i, j) : c} of the terms c * x^i * y^j
+    def getCoefficients(self):
+        return dict(self.__coefficients)
+
+    #Highest powers of x and y
+    def getDegrees(self):
+        return degrees(self.__coefficients)
+
+    #Dense coefficient matrix, row i and column j holding the
+    #coefficient of x^i * y^j
+    def getMatrix(self):
+        maxI, maxJ = self.getDegrees()
+        matrix = [[0] * (maxJ + 1) for i in range(maxI + 1)]
+        for (i, j), c in self.__coefficients.items():
+            matrix[i][j] = c
+        return matrix
+
+    #Source of kernel(x, y) that runs nested Horner's scheme over the rows
+    #of the matrix: each row is a polynomial in y and the rows are the
+    #coefficients of a polynomial in x.  Plain statements are used instead
+    #of one nested expression, which Python limits in depth
+    def getSource(self):
+        lines = ["def kernel(x, y):"]
+        matrix = self.getMatrix()
+        first = True
+        for row in reversed(matrix):
+            while len(row) > 1 and row[-1] == 0:
+                row = row[:-1]
+            lines.append("    r = " + repr(float(row[-1])))
+            for c in reversed(row[:-1]):
+                if c == 0:
+                    lines.append("    r = r * y")
+                else:
+                    lines.append("    r = r * y + " + repr(float(c)))
+            if first:
+                lines.append("    z = r")
+                first = False
+            else:
+                lines.append("    z = z * x + r")
+        lines.append("    return z")
+        return "\n".join(lines) + "\n"
+
+    #Horner kernel f(x, y), which works for numbers and numpy arrays
+    def getKernel(self):
+        if self.__kernel is None:
+            namespace = {}
+            exec(compile(self.getSource(), "<polynomial>", "exec"), namespace)
+            self.__kernel = namespace['kernel']
+        return self.__kernel
+
+    def eval(self, x, y):
+        return self.getKernel()(x, y)
+
+    #Evaluate over arrays of x and y; see Function.evalArray
+    def evalArray(self, x, y):
+        return evalBroadcast(self.getKernel(), (x, y))
+
+    #Polynomials are equal when their coefficients are, however
+    #they were written
+    def __eq__(self, other):
+        return isinstance(other, Polynomial) and self.__coefficients == other.getCoefficients()
+
+    def __hash__(self):
+        return hash(frozenset(self.__coefficients.items()))
+
+    def __repr__(self):
+        terms = sorted(self.__coefficients.items(), reverse = True)
+        return "Polynomial(" + repr(dict(terms)) + ")"
@@ -0,0 +1,149 @@
+#Per-node profiling of Functions.  A ProfiledFunction evaluates the same
+#tree as the Function it wraps, but times every node and counts how often
+#it ran.  The report maps the costs back to expression text.  Plain
+#Function evaluation is not touched, so it costs nothing when unused.
+#  profiled = profileFunction("z=(x^2+y^2)^3/(x^2+y^2)")
+#  profiled.eval(1.0, 2.0)
+#  print(profiled.report())
+import time
+from function_parser import Function, Lexer, Parser, OPERATOR, postorder, formatNode, evalBroadcast
+from function_optimizer import Optimizer
+
+#Longest expression text shown per row of the report
+MAX_TEXT = 60
+
+#Time spent in each stage of building one Function
+class BuildTimes:
+    def __init__(self, lexSeconds, parseSeconds, optimizeSeconds):
+        self.__lexSeconds = lexSeconds
+        self.__parseSeconds = parseSeconds
+        self.__optimizeSeconds = optimizeSeconds
+
+    def getLexSeconds(self):
+        return self.__lexSeconds
+
+    def getParseSeconds(self):
+        return self.__parseSeconds
+
+    def getOptimizeSeconds(self):
+        return self.__optimizeSeconds
+
+#Build a Function from strVal the way Function does, timing lexing,
+#parsing and optimizing separately.  Returns a ProfiledFunction
+def profileFunction(strVal, optimize = True, variables = None):
+    start = time.perf_counter()
+    lexer = Lexer(strVal + "$", variables)
+    lexed = time.perf_counter()
+    root = Parser(strVal, lexer, variables).getRoot()
+    parsed = time.perf_counter()
+    if optimize:
+        root = Optimizer(root).getRoot()
+    optimized = time.perf_counter()
+    function = Function(strVal, False, root, variables)
+    times = BuildTimes(lexed - start, parsed - lexed, optimized - parsed)
+    return ProfiledFunction(function, times)
+
+class ProfiledFunction:
+    def __init__(self, function, buildTimes = None):
+        self.__function = function
+        self.__buildTimes = buildTimes
+        self.__order = postorder(function.getRoot())
+        #Slot of every variable node, resolved once
+        self.__slots = {}
+        variables = function.getVariables()
+        for node in self.__order:
+            if node.getLeft() is None and type(node.getVal()) == str:
+                self.__slots[id(node)] = variables.index(node.getVal())
+        self.reset()
+
+    #Forget the counts and times collected so far
+    def reset(self):
+        self.__counts = {}
+        self.__seconds = {}
+        for node in self.__order:
+            self.__counts[id(node)] = 0
+            self.__seconds[id(node)] = 0.0
+        self.__evaluations = 0
+
+    def getFunction(self):
+        return self.__function
+
+    def getBuildTimes(self):
+        return self.__buildTimes
+
+    #Evaluate the nodes in postorder, timing each one on its own
+    def __run(self, values, getOperation):
+        if len(values) != len(self.__function.getVariables()):
+            raise TypeError("expected one value per variable (" + ", ".join(self.__function.getVariables()) + ")")
+        results = {}
+        slots = self.__slots
+        counts = self.__counts
+        seconds = self.__seconds
+        clock = time.perf_counter
+        for node in self.__order:
+            key = id(node)
+            start = clock()
+            val = node.getVal()
+            valType = type(val)
+            if valType == int or valType == float:
+                result = val
+            elif node.getLeft() is None:
+                result = values[slots[key]]
+            elif node.getRight() is None:
+                operation = getOperation(val)
+                result = operation(results[id(node.getLeft())])
+            else:
+                operation = getOperation(val)
+                result = operation(results[id(node.getLeft())], results[id(node.getRight())])
+            seconds[key] += clock() - start
+            counts[key] += 1
+            results[key] = result
+        self.__evaluations += 1
+        return results[id(self.__order[-1])]
+
+    def eval(self, *values):
+        return self.__run(values, OPERATOR.getOperation)
+
+    #Profiled version of Function.evalArray; every node counts once per batch
+    def evalArray(self, *values):
+        return evalBroadcast(lambda *arrays: self.__run(arrays, OPERATOR.getArrayOperation), values)
+
+    def getEvaluations(self):
+        return self.__evaluations
+
+    #Rows of (expression text, count, own seconds, subtree seconds) for
+    #every operator node, costliest subtree first.  A shared subtree is
+    #counted once in the subtree time of each parent that uses it
+    def getRows(self):
+        subtree = {}
+        rows = []
+        for node in self.__order:
+            key = id(node)
+            total = self.__seconds[key]
+            if node.getLeft() is not None:
+                total += subtree[id(node.getLeft())]
+                if node.getRight() is not None:
+                    total += subtree[id(node.getRight())]
+                rows.append((formatNode(node), self.__counts[key], self.__seconds[key], total))
+            subtree[key] = total
+        rows.sort(key = lambda row: row[3], reverse = True)
+        return rows
+
+    #Text report of the build times and the costliest subtrees
+    def report(self, limit = 20):
+        lines = []
+        if self.__buildTimes is not None:
+            lines.append("build: lex %.6f s, parse %.6f s, optimize %.6f s" % (
+                self.__buildTimes.getLexSeconds(), self.__buildTimes.getParseSeconds(),
+                self.__buildTimes.getOptimizeSeconds()))
+        lines.append("evaluations: " + str(self.__evaluations))
+        rows = self.getRows()
+        if len(rows) == 0:
+            return "\n".join(lines)
+        rootSeconds = max(rows[0][3], 1e-12)
+        lines.append("%10s %12s %12s %7s  %s" % ("count", "self s", "subtree s", "share", "expression"))
+        for text, count, own, total in rows[:limit]:
+            if len(text) > MAX_TEXT:
+                text = text[:MAX_TEXT - 3] + "..."
+            lines.append("%10d %12.6f %12.6f %6.1f%%  %s" % (count, own, total, 100.0 * total / rootSeconds, text))
+        return "\n".join(lines)
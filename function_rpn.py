@@ -0,0 +1,372 @@
+#Flat postfix (RPN) form of a function tree.  A program is three typed
+#arrays: opcodes, one int32 operand per opcode, and the constants.  It
+#runs on a small stack machine and saves to a compact binary format that
+#can be loaded memory-mapped, so precompiled formulas need no parsing.
+#
+#Binary program layout (little endian, sections aligned to 8 bytes):
+#  header    '<4sHHIIIII'  magic 'FRPN', version, name count, opcode count,
+#                          constant count, temp count, max stack, source bytes
+#  opcodes   uint8  x opcode count
+#  operands  int32  x opcode count
+#  constants float64 x constant count
+#  kinds     uint8  x constant count (0 int, 1 float)
+#  source    utf-8 text of the function
+#  names     per named function called: uint8 length, utf-8 name
+#A bundle holds many programs: header '<4sHHI' (magic 'FRPB', version, 0,
+#count), then one uint64 offset and one uint64 length per program
+import mmap
+import struct
+import sys
+from array import array
+from function_parser import Function, OPERATOR, NodeTable, postorder, formatNode, evalBroadcast
+
+#Opcodes.  VAR pushes variable slot operand (0 is x, 1 is y), CONST pushes
+#constant number operand, STORE copies the top of the stack into temp
+#operand and LOAD pushes it back, for subtrees that are shared.  CALL
+#applies named function operand (an index into the program's names) to
+#the top of the stack
+OP_CONST = 0
+OP_VAR = 1
+OP_LOAD = 2
+OP_STORE = 3
+OP_ADD = 4
+OP_SUB = 5
+OP_MUL = 6
+OP_DIV = 7
+OP_POW = 8
+OP_CALL = 9
+
+OPCODES = {'+' : OP_ADD, '-' : OP_SUB, '*' : OP_MUL, '/' : OP_DIV, '^' : OP_POW}
+OPERATORS = {OP_ADD : '+', OP_SUB : '-', OP_MUL : '*', OP_DIV : '/', OP_POW : '^'}
+VARIABLES = ['x', 'y']
+
+KIND_INT = 0
+KIND_FLOAT = 1
+
+VERSION = 2
+BUNDLE_VERSION = 1
+PROGRAM_MAGIC = b'FRPN'
+BUNDLE_MAGIC = b'FRPB'
+PROGRAM_HEADER = struct.Struct('<4sHHIIIII')
+BUNDLE_HEADER = struct.Struct('<4sHHI')
+BUNDLE_ENTRY = struct.Struct('<QQ')
+
+#Does a float64 constant hold the integer val exactly?  Large powers of
+#two like 2^60 do, while most integers above 2^53 do not
+def isExactFloat(val):
+    try:
+        return float(val) == val
+    except OverflowError:
+        return False
+
+#Round n up to a multiple of 8
+def align(n):
+    return (n + 7) & ~7
+
+#Typed view of a section of a buffer without copying it.  Data is little
+#endian, so big endian hosts get a swapped copy instead
+def sectionView(buffer, offset, count, typecode):
+    itemSize = array(typecode).itemsize
+    view = memoryview(buffer)[offset:offset + count * itemSize].cast('B').cast(typecode)
+    if sys.byteorder == 'big' and itemSize > 1:
+        swapped = array(typecode, view)
+        swapped.byteswap()
+        return swapped
+    return view
+
+class RPNProgram:
+    def __init__(self, opcodes, operands, constants, kinds, tempCount, maxStack, source = "", names = ()):
+        self.__opcodes = opcodes
+        self.__operands = operands
+        self.__constants = constants
+        self.__kinds = kinds
+        self.__tempCount = tempCount
+        self.__maxStack = maxStack
+        self.__source = source
+        self.__names = list(names)
+        self.__values = None
+        self.__steps = {}
+
+    #Constants as Python numbers, ints restored from their kind
+    def __getValues(self):
+        if self.__values is None:
+            self.__values = []
+            for i in range(len(self.__constants)):
+                if self.__kinds[i] == KIND_INT:
+                    self.__values.append(int(self.__constants[i]))
+                else:
+                    self.__values.append(self.__constants[i])
+        return self.__values
+
+    #(opcode, argument) steps of the program for one getOperation, made
+    #once per table: constants, operators and named functions are looked
+    #up here instead of on every run.  Every operator becomes OP_ADD with
+    #the function applying it as the argument, which is what makes the
+    #same program work for arrays
+    def __getSteps(self, getOperation):
+        steps = self.__steps.get(getOperation)
+        if steps is None:
+            values = self.__getValues()
+            calls = [getOperation(name) for name in self.__names]
+            steps = []
+            for opcode, operand in zip(self.__opcodes, self.__operands):
+                if opcode in OPERATORS:
+                    steps.append((OP_ADD, getOperation(OPERATORS[opcode])))
+                elif opcode == OP_CONST:
+                    steps.append((OP_CONST, values[operand]))
+                elif opcode == OP_CALL:
+                    steps.append((OP_CALL, calls[operand]))
+                else:
+                    steps.append((opcode, operand))
+            self.__steps[getOperation] = steps
+        return steps
+
+    #Run the stack machine
+    def __run(self, x, y, getOperation):
+        variables = (x, y)
+        temps = [None] * self.__tempCount
+        stack = []
+        push = stack.append
+        pop = stack.pop
+        for opcode, argument in self.__getSteps(getOperation):
+            if opcode == OP_ADD:
+                right = pop()
+                stack[-1] = argument(stack[-1], right)
+            elif opcode == OP_VAR:
+                push(variables[argument])
+            elif opcode == OP_CONST:
+                push(argument)
+            elif opcode == OP_LOAD:
+                push(temps[argument])
+            elif opcode == OP_STORE:
+                temps[argument] = stack[-1]
+            else:
+                stack[-1] = argument(stack[-1])
+        return stack[-1]
+
+    def eval(self, x, y):
+        return self.__run(x, y, OPERATOR.getOperation)
+
+    #Evaluate numpy arrays of x and y; see Function.evalArray
+    def evalArray(self, x, y):
+        return evalBroadcast(lambda xArr, yArr: self.__run(xArr, yArr, OPERATOR.getArrayOperation), (x, y))
+
+    #Rebuild the node tree, so a loaded program can be used with
+    #everything that takes a Function (see toFunction)
+    def getRoot(self, nodes = None):
+        if nodes is None:
+            nodes = NodeTable()
+        values = self.__getValues()
+        temps = [None] * self.__tempCount
+        stack = []
+        for opcode, operand in zip(self.__opcodes, self.__operands):
+            if opcode == OP_CONST:
+                stack.append(nodes.getNode(values[operand]))
+            elif opcode == OP_VAR:
+                stack.append(nodes.getNode(VARIABLES[operand]))
+            elif opcode == OP_LOAD:
+                stack.append(temps[operand])
+            elif opcode == OP_STORE:
+                temps[operand] = stack[-1]
+            elif opcode == OP_CALL:
+                stack[-1] = nodes.getNode(self.__names[operand], stack[-1])
+            else:
+                right = stack.pop()
+                stack[-1] = nodes.getNode(OPERATORS[opcode], stack[-1], right)
+        return stack[-1]
+
+    def toFunction(self):
+        return Function(self.__source or None, False, self.getRoot())
+
+    def getOpcodes(self):
+        return self.__opcodes
+
+    def getOperands(self):
+        return self.__operands
+
+    def getConstants(self):
+        return self.__constants
+
+    def getSource(self):
+        return self.__source
+
+    #Names of the named functions the program calls
+    def getNames(self):
+        return self.__names
+
+    def __len__(self):
+        return len(self.__opcodes)
+
+    #Binary form of the program, see the layout at the top of the module
+    def toBytes(self):
+        source = self.__source.encode('utf-8')
+        codeCount = len(self.__opcodes)
+        constCount = len(self.__constants)
+        sections = [
+            array('B', self.__opcodes),
+            array('i', self.__operands),
+            array('d', self.__constants),
+            array('B', self.__kinds)
+        ]
+        if sys.byteorder == 'big':
+            for section in sections:
+                section.byteswap()
+        data = bytearray(PROGRAM_HEADER.pack(PROGRAM_MAGIC, VERSION, len(self.__names), codeCount,
+            constCount, self.__tempCount, self.__maxStack, len(source)))
+        for section in sections:
+            data += bytes(align(len(data)) - len(data))
+            data += section.tobytes()
+        data += source
+        for name in self.__names:
+            encoded = name.encode('utf-8')
+            data.append(len(encoded))
+            data += encoded
+        return bytes(data)
+
+    #Program over a buffer made by toBytes, starting at offset.  The arrays
+    #are views into the buffer, so a memory map is not copied
+    def fromBuffer(buffer, offset = 0):
+        magic, version, nameCount, codeCount, constCount, tempCount, maxStack, sourceLength = \
+            PROGRAM_HEADER.unpack_from(buffer, offset)
+        if magic != PROGRAM_MAGIC or version != VERSION:
+            raise ValueError("not an RPN program of version " + str(VERSION))
+        position = offset + PROGRAM_HEADER.size
+        sections = []
+        for count, typecode in [(codeCount, 'B'), (codeCount, 'i'), (constCount, 'd'), (constCount, 'B')]:
+            position = offset + align(position - offset)
+            sections.append(sectionView(buffer, position, count, typecode))
+            position += count * array(typecode).itemsize
+        source = bytes(buffer[position:position + sourceLength]).decode('utf-8')
+        position += sourceLength
+        names = []
+        for i in range(nameCount):
+            length = buffer[position]
+            names.append(bytes(buffer[position + 1:position + 1 + length]).decode('utf-8'))
+            position += 1 + length
+        return RPNProgram(sections[0], sections[1], sections[2], sections[3], tempCount, maxStack,
+            source, names)
+
+#Translate a node tree, or a Function, into an RPNProgram.  Operator
+#nodes with more than one parent are computed once, stored in a temp and
+#loaded afterwards.  Programs take x and y in that order, so a Function
+#or variables list with other variables is refused
+def compileProgram(root, source = None, variables = None):
+    if isinstance(root, Function):
+        variables = root.getVariables()
+        if source is None:
+            source = root.getSource()
+        root = root.getRoot()
+    if variables is not None and list(variables) != VARIABLES:
+        raise ValueError("a program takes x and y; cannot compile a function of " + ", ".join(variables))
+    order = postorder(root)
+    parents = {}
+    for node in order:
+        for child in (node.getLeft(), node.getRight()):
+            if child is not None:
+                parents[id(child)] = parents.get(id(child), 0) + 1
+    opcodes = array('B')
+    operands = array('i')
+    constants = array('d')
+    kinds = array('B')
+    constantIndex = {}
+    nameIndex = {}
+    tempIndex = {}
+    depth = 0
+    maxStack = 0
+    stack = [(root, False)]
+    while stack:
+        node, expanded = stack.pop()
+        val = node.getVal()
+        valType = type(val)
+        if not expanded:
+            if id(node) in tempIndex:
+                opcodes.append(OP_LOAD)
+                operands.append(tempIndex[id(node)])
+            elif valType == int or valType == float:
+                key = (valType, val)
+                if key not in constantIndex:
+                    if valType == int and not isExactFloat(val):
+                        raise ValueError("integer constant " + str(val) + " does not fit a program")
+                    constantIndex[key] = len(constants)
+                    constants.append(val)
+                    kinds.append(KIND_INT if valType == int else KIND_FLOAT)
+                opcodes.append(OP_CONST)
+                operands.append(constantIndex[key])
+            elif node.getLeft() is None:
+                if val not in VARIABLES:
+                    raise ValueError("variable " + repr(val) + " does not fit a program; only x and y do")
+                opcodes.append(OP_VAR)
+                operands.append(VARIABLES.index(val))
+            elif node.getRight() is None:
+                stack.append((node, True))
+                stack.append((node.getLeft(), False))
+                continue
+            else:
+                stack.append((node, True))
+                stack.append((node.getRight(), False))
+                stack.append((node.getLeft(), False))
+                continue
+            depth += 1
+            maxStack = max(maxStack, depth)
+        else:
+            if node.getRight() is None:
+                if val not in nameIndex:
+                    if len(val.encode('utf-8')) > 255:
+                        raise ValueError("function name " + val + " does not fit a program")
+                    nameIndex[val] = len(nameIndex)
+                opcodes.append(OP_CALL)
+                operands.append(nameIndex[val])
+            else:
+                opcodes.append(OPCODES[val])
+                operands.append(0)
+                depth -= 1
+            if parents.get(id(node), 0) > 1:
+                tempIndex[id(node)] = len(tempIndex)
+                opcodes.append(OP_STORE)
+                operands.append(tempIndex[id(node)])
+    if source is None:
+        source = "z=" + formatNode(root)
+    return RPNProgram(opcodes, operands, constants, kinds, len(tempIndex), maxStack, source, nameIndex.keys())
+
+#Write one program to a file
+def saveProgram(path, program):
+    with open(path, 'wb') as file:
+        file.write(program.toBytes())
+
+#Write many programs to one bundle file
+def saveBundle(path, programs):
+    blobs = [program.toBytes() for program in programs]
+    position = align(BUNDLE_HEADER.size + BUNDLE_ENTRY.size * len(blobs))
+    entries = []
+    for blob in blobs:
+        entries.append((position, len(blob)))
+        position = align(position + len(blob))
+    with open(path, 'wb') as file:
+        file.write(BUNDLE_HEADER.pack(BUNDLE_MAGIC, BUNDLE_VERSION, 0, len(blobs)))
+        for offset, length in entries:
+            file.write(BUNDLE_ENTRY.pack(offset, length))
+        for (offset, length), blob in zip(entries, blobs):
+            file.write(bytes(offset - file.tell()))
+            file.write(blob)
+
+#Memory map a file read only.  The map stays open as long as
+#programs loaded from it are alive
+def mapFile(path):
+    with open(path, 'rb') as file:
+        return mmap.mmap(file.fileno(), 0, access = mmap.ACCESS_READ)
+
+#Load one program from a file written by saveProgram
+def loadProgram(path):
+    return RPNProgram.fromBuffer(mapFile(path))
+
+#Load every program of a bundle written by saveBundle
+def loadBundle(path):
+    buffer = mapFile(path)
+    magic, version, flags, count = BUNDLE_HEADER.unpack_from(buffer, 0)
+    if magic != BUNDLE_MAGIC or version != BUNDLE_VERSION:
+        raise ValueError("not an RPN bundle of version " + str(BUNDLE_VERSION))
+    programs = []
+    for i in range(count):
+        offset, length = BUNDLE_ENTRY.unpack_from(buffer, BUNDLE_HEADER.size + i * BUNDLE_ENTRY.size)
+        programs.append(RPNProgram.fromBuffer(buffer, offset))
+    return programs
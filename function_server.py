@@ -0,0 +1,257 @@
+#Local evaluation server.  Clients send one JSON request per line over TCP
+#and get one JSON response per line, matched by the request's "id":
+#  {"id": 1, "function": "z=x^2+y", "x": 1.5, "y": 2}
+#  {"id": 1, "z": 4.25}
+#  {"id": 2, "function": "z=x/y", "xs": [1, 2], "ys": [4, 8]}
+#  {"id": 2, "z": [0.25, 0.25]}
+#  {"id": 3, "function": "z=x+", "x": 1, "y": 2}
+#  {"id": 3, "error": {"type": "syntax", "message": "...", "expected": "Int", "saw": "EOI"}}
+#  {"id": 4, "function": "z=x)+3", "x": 1, "y": 2}
+#  {"id": 4, "error": {"type": "syntax", "message": "...", "expected": "EOI", "saw": "Parenthesis"}}
+#  {"id": 5, "op": "stats"}
+#Parsed functions come from a FunctionCache.  Point requests for the same
+#function that arrive within batchDelay seconds of each other are
+#evaluated together as one batch; with the default of 0 a batch holds the
+#requests that arrived in the same turn of the event loop.  Non-finite values are written as
+#NaN and Infinity, which Python's json module reads back.
+#  python function_server.py --port 7341
+import argparse
+import asyncio
+import json
+import math
+import time
+from function_parser import FunctionSyntaxError, numpy
+from function_cache import FunctionCache
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 7341
+DEFAULT_BATCH_DELAY = 0.0
+DEFAULT_MAX_BATCH = 65536
+
+#Longest request line the server reads
+MAX_LINE = 64 * 1024 * 1024
+
+#Request that cannot be served; kind is the "type" of the error response
+class RequestError(Exception):
+    def __init__(self, kind, message):
+        Exception.__init__(self, message)
+        self.__kind = kind
+
+    def getKind(self):
+        return self.__kind
+
+#Error response body for an exception
+def errorBody(error):
+    if isinstance(error, FunctionSyntaxError):
+        return {'type' : 'syntax', 'message' : str(error),
+            'expected' : error.getExpected(), 'saw' : error.getSaw()}
+    if isinstance(error, RequestError):
+        return {'type' : error.getKind(), 'message' : str(error)}
+    return {'type' : 'evaluation', 'message' : type(error).__name__ + ": " + str(error)}
+
+#Numbers of a request field as floats
+def toFloats(values, name):
+    try:
+        return [float(value) for value in values]
+    except (TypeError, ValueError):
+        raise RequestError('request', name + " must hold numbers")
+
+#Point coordinates of a request as (xs, ys, single point?)
+def requestPoints(request):
+    if 'xs' in request or 'ys' in request:
+        xs = request.get('xs')
+        ys = request.get('ys')
+        if type(xs) != list or type(ys) != list or len(xs) != len(ys):
+            raise RequestError('request', "xs and ys must be lists of the same length")
+        return (toFloats(xs, 'xs'), toFloats(ys, 'ys'), False)
+    if 'x' not in request or 'y' not in request:
+        raise RequestError('request', "a request needs x and y or xs and ys")
+    return (toFloats([request['x']], 'x'), toFloats([request['y']], 'y'), True)
+
+#Evaluate function at every point, one batch when numpy is there.
+#Without numpy, points where the function is not a real number give nan
+def evalPoints(function, xs, ys):
+    if numpy is not None:
+        return function.evalArray(numpy.array(xs), numpy.array(ys)).tolist()
+    values = []
+    for x, y in zip(xs, ys):
+        try:
+            value = function.eval(x, y)
+        except ArithmeticError:
+            value = math.nan
+        if type(value) == complex:
+            value = math.nan
+        values.append(value)
+    return values
+
+class FunctionServer:
+    def __init__(self, host = DEFAULT_HOST, port = DEFAULT_PORT, cache = None,
+            batchDelay = DEFAULT_BATCH_DELAY, maxBatch = DEFAULT_MAX_BATCH):
+        self.__host = host
+        self.__port = port
+        if cache is None:
+            cache = FunctionCache()
+        self.__cache = cache
+        self.__batchDelay = batchDelay
+        self.__maxBatch = maxBatch
+        self.__pending = {}
+        self.__server = None
+        self.__requests = 0
+        self.__errors = 0
+        self.__points = 0
+        self.__batches = 0
+        self.__started = time.perf_counter()
+
+    #Start listening.  Port 0 picks a free port; see getPort
+    async def start(self):
+        self.__server = await asyncio.start_server(self.__serve, self.__host, self.__port, limit = MAX_LINE)
+        self.__port = self.__server.sockets[0].getsockname()[1]
+        self.__started = time.perf_counter()
+
+    async def serveForever(self):
+        if self.__server is None:
+            await self.start()
+        async with self.__server:
+            await self.__server.serve_forever()
+
+    async def close(self):
+        if self.__server is not None:
+            self.__server.close()
+            await self.__server.wait_closed()
+
+    def getPort(self):
+        return self.__port
+
+    #Counters of the server and its function cache
+    def getStats(self):
+        seconds = time.perf_counter() - self.__started
+        return {
+            'requests' : self.__requests,
+            'errors' : self.__errors,
+            'points' : self.__points,
+            'batches' : self.__batches,
+            'pointsPerBatch' : self.__points / self.__batches if self.__batches > 0 else 0.0,
+            'seconds' : seconds,
+            'cache' : self.__cache.getStats()
+        }
+
+    #Read request lines from one connection.  Each request is answered by
+    #its own task, so a slow one does not hold up the rest
+    async def __serve(self, reader, writer):
+        tasks = set()
+        try:
+            while True:
+                line = await reader.readline()
+                if len(line) == 0:
+                    break
+                if line.strip() == b'':
+                    continue
+                task = asyncio.ensure_future(self.__answer(line, writer))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+            if len(tasks) > 0:
+                await asyncio.wait(tasks)
+        except (ConnectionError, ValueError):
+            pass
+        except asyncio.CancelledError:
+            #The server is closing
+            pass
+        finally:
+            writer.close()
+
+    async def __answer(self, line, writer):
+        response = await self.__handle(line)
+        writer.write(json.dumps(response).encode('utf-8') + b'\n')
+        try:
+            await writer.drain()
+        except ConnectionError:
+            pass
+
+    #Response for one request line
+    async def __handle(self, line):
+        self.__requests += 1
+        requestId = None
+        try:
+            try:
+                request = json.loads(line)
+            except ValueError as error:
+                raise RequestError('request', "not JSON: " + str(error))
+            if type(request) != dict:
+                raise RequestError('request', "a request must be a JSON object")
+            requestId = request.get('id')
+            if request.get('op') == 'stats':
+                return {'id' : requestId, 'stats' : self.getStats()}
+            source = request.get('function')
+            if type(source) != str:
+                raise RequestError('request', "a request needs a function string")
+            xs, ys, single = requestPoints(request)
+            function = self.__cache.getFunction(source)
+            values = await self.__evaluate(function, xs, ys)
+            return {'id' : requestId, 'z' : values[0] if single else values}
+        except Exception as error:
+            self.__errors += 1
+            return {'id' : requestId, 'error' : errorBody(error)}
+
+    #Add the points to the pending batch of function and wait for the
+    #batch to be evaluated.  The first request of a batch schedules it
+    async def __evaluate(self, function, xs, ys):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        batch = self.__pending.get(function)
+        if batch is None:
+            batch = [[], 0]
+            self.__pending[function] = batch
+            loop.call_later(self.__batchDelay, self.__flush, function, batch)
+        batch[0].append((xs, ys, future))
+        batch[1] += len(xs)
+        if batch[1] >= self.__maxBatch:
+            self.__flush(function, batch)
+        return await future
+
+    #Evaluate every request of a batch with one call and hand each
+    #request its slice of the results
+    def __flush(self, function, batch):
+        if self.__pending.get(function) is not batch:
+            return
+        del self.__pending[function]
+        requests = batch[0]
+        xs = []
+        ys = []
+        for requestXs, requestYs, future in requests:
+            xs += requestXs
+            ys += requestYs
+        self.__batches += 1
+        self.__points += len(xs)
+        try:
+            values = evalPoints(function, xs, ys)
+        except Exception as error:
+            for requestXs, requestYs, future in requests:
+                if not future.done():
+                    future.set_exception(error)
+            return
+        start = 0
+        for requestXs, requestYs, future in requests:
+            end = start + len(requestXs)
+            if not future.done():
+                future.set_result(values[start:end])
+            start = end
+
+def main(args = None):
+    argParser = argparse.ArgumentParser(description = "Serve function evaluation over JSON lines on TCP")
+    argParser.add_argument('--host', default = DEFAULT_HOST, help = "address to listen on")
+    argParser.add_argument('--port', type = int, default = DEFAULT_PORT, help = "port to listen on")
+    argParser.add_argument('--batch-delay', type = float, default = DEFAULT_BATCH_DELAY,
+        help = "seconds to wait for more requests of the same function")
+    argParser.add_argument('--max-batch', type = int, default = DEFAULT_MAX_BATCH,
+        help = "points that make a batch run right away")
+    argParser.add_argument('--cache-size', type = int, default = 1024, help = "parsed functions to keep")
+    options = argParser.parse_args(args)
+    server = FunctionServer(options.host, options.port, FunctionCache(options.cache_size),
+        options.batch_delay, options.max_batch)
+    try:
+        asyncio.run(server.serveForever())
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,306 @@
+#Vectorized root finding on Functions.  Solves f = level for one variable
+#at many points at once, the other variables held at given values:
+#  solution = solve(Function("z=x^2+y^3"), 2.0, 0.0, 5.0, xs)
+#  ys = solution.getRoots()                y with x^2+y^3 = 2 for each x
+#  solution = solve(function, 2.0, 0.0, 5.0, ys, variable = 'x')
+#Every point needs a bracket lo, hi where f - level changes sign; see
+#findBrackets to search for one.  All the points still being solved take
+#one step together, a compiled batch evaluation of the function (and its
+#derivative) per iteration instead of one tree walk per point and step.
+#Each step is a Newton step, or a false position step for functions
+#without a derivative, and a bisection instead when that step would
+#leave the bracket or does not make progress fast enough.
+#Division by zero gives infinities with a sign, so brackets around a pole
+#like 1/(y-1) change sign too; bisection then closes in on the pole and
+#the point is reported as POLE instead of as a root
+from function_parser import requireNumpy, numpy
+
+DEFAULT_TOLERANCE = 1e-12
+DEFAULT_MAX_ITERATIONS = 100
+DEFAULT_BATCH_SIZE = 65536
+DEFAULT_SAMPLES = 64
+
+#Status of each point of a Solution.  NO_BRACKET: f - level has the same
+#sign at lo and hi or is nan at one of them.  UNDEFINED: f is nan at a
+#point inside the bracket.  NOT_CONVERGED: maxIterations ran out
+CONVERGED = 0
+NO_BRACKET = 1
+POLE = 2
+UNDEFINED = 3
+NOT_CONVERGED = 4
+
+STATUS_NAMES = {
+    CONVERGED : 'converged',
+    NO_BRACKET : 'no bracket',
+    POLE : 'pole',
+    UNDEFINED : 'undefined',
+    NOT_CONVERGED : 'not converged'
+}
+
+#Roots and per point results of solve, all arrays of the broadcast shape
+#of the arguments.  Points that did not converge have nan roots
+class Solution:
+    def __init__(self, roots, residuals, iterations, status, evaluations):
+        self.__roots = roots
+        self.__residuals = residuals
+        self.__iterations = iterations
+        self.__status = status
+        self.__evaluations = evaluations
+
+    def getRoots(self):
+        return self.__roots
+
+    #f - level at the roots
+    def getResiduals(self):
+        return self.__residuals
+
+    #Steps taken for each point
+    def getIterations(self):
+        return self.__iterations
+
+    #One of CONVERGED, NO_BRACKET, POLE, UNDEFINED, NOT_CONVERGED per point
+    def getStatus(self):
+        return self.__status
+
+    def getConverged(self):
+        return self.__status == CONVERGED
+
+    #Batch evaluations of the function, the same for any number of points
+    def getEvaluations(self):
+        return self.__evaluations
+
+    #Number of points with each status, by status name
+    def getCounts(self):
+        counts = {}
+        for status, name in STATUS_NAMES.items():
+            counts[name] = int(numpy.count_nonzero(self.__status == status))
+        return counts
+
+    def __len__(self):
+        return self.__roots.size
+
+#Values of the variables other than variable, as a list with None in
+#the slot of variable.  fixed is one array for a function of two
+#variables, otherwise a dict of arrays by variable name
+def fixedValues(function, variable, fixed):
+    variables = function.getVariables()
+    if variable not in variables:
+        raise ValueError("cannot solve for " + repr(variable) + ": the function takes " + ", ".join(variables))
+    others = [name for name in variables if name != variable]
+    if type(fixed) != dict:
+        if len(others) != 1:
+            raise ValueError("give the values of " + ", ".join(others) + " as a dict")
+        fixed = {others[0] : fixed}
+    values = []
+    for name in variables:
+        if name == variable:
+            values.append(None)
+        elif name not in fixed:
+            raise ValueError("no values for variable " + repr(name))
+        else:
+            values.append(numpy.asarray(fixed[name], dtype = float))
+    return values
+
+#Flatten the arguments to 1-D arrays of their broadcast size.  Returns
+#(shape, level, lo, hi, values)
+def flattenArguments(level, lo, hi, values):
+    arrays = [numpy.asarray(level, dtype = float), numpy.asarray(lo, dtype = float),
+        numpy.asarray(hi, dtype = float)] + [value for value in values if value is not None]
+    shape = numpy.broadcast(*arrays).shape
+    flat = [numpy.broadcast_to(array, shape).ravel() for array in arrays]
+    level, lo, hi = flat[0], flat[1], flat[2]
+    rest = iter(flat[3:])
+    values = [None if value is None else next(rest) for value in values]
+    return (shape, level, lo, hi, values)
+
+#The function and its derivative with respect to variable, compiled, as
+#callables of the solved values and the fixed values of the same points.
+#The derivative is None if the function cannot be differentiated
+def makeEvaluators(function, variable, newton):
+    function.ensureCompiled()
+    derivative = None
+    if newton:
+        try:
+            derivative = function.derivative(variable)
+            derivative.ensureCompiled()
+        except ValueError:
+            derivative = None
+    slot = function.getVariables().index(variable)
+
+    def evaluate(target, t, values, index):
+        arguments = [t if i == slot else value[index] for i, value in enumerate(values)]
+        return target.evalArray(*arguments)
+
+    def evalFunction(t, values, index):
+        return evaluate(function, t, values, index)
+
+    evalDerivative = None
+    if derivative is not None:
+        def evalDerivative(t, values, index):
+            return evaluate(derivative, t, values, index)
+    return (evalFunction, evalDerivative)
+
+#Solve one batch of flattened points in place of the output arrays.
+#Returns the number of batch evaluations.  a < b is kept for every
+#point; ga and gb are f - level at a and b
+def solveBatch(evalFunction, evalDerivative, level, lo, hi, values, tolerance, maxIterations,
+        roots, residuals, iterations, status):
+    a = numpy.minimum(lo, hi)
+    b = numpy.maximum(lo, hi)
+    everything = numpy.arange(len(a))
+    ga = evalFunction(a, values, everything) - level
+    gb = evalFunction(b, values, everything) - level
+    evaluations = 2
+    #f - level at the bracket before solving, to tell roots from poles
+    start = numpy.minimum(numpy.abs(ga), numpy.abs(gb))
+    status[:] = NOT_CONVERGED
+    atA = ga == 0
+    atB = (gb == 0) & ~atA
+    roots[atA] = a[atA]
+    roots[atB] = b[atB]
+    residuals[atA | atB] = 0.0
+    status[atA | atB] = CONVERGED
+    noBracket = ~(atA | atB) & ~(((ga < 0) & (gb > 0)) | ((ga > 0) & (gb < 0)))
+    status[noBracket] = NO_BRACKET
+    active = status == NOT_CONVERGED
+    x = 0.5 * (a + b)
+    width = b - a
+    #Lengths of the last two steps, for the Newton safeguard
+    lastStep = b - a
+    olderStep = b - a
+    bisect = numpy.zeros(len(a), dtype = bool)
+    for iteration in range(maxIterations):
+        index = numpy.flatnonzero(active)
+        if len(index) == 0:
+            break
+        t = x[index]
+        gt = evalFunction(t, values, index) - level[index]
+        evaluations += 1
+        iterations[index] += 1
+        #nan inside the bracket: the function is not defined there
+        undefined = numpy.isnan(gt)
+        status[index[undefined]] = UNDEFINED
+        exact = gt == 0
+        roots[index[exact]] = t[exact]
+        residuals[index[exact]] = 0.0
+        status[index[exact]] = CONVERGED
+        #Keep the half of the bracket where the sign changes
+        moveA = (numpy.signbit(gt) == numpy.signbit(ga[index])) & ~undefined & ~exact
+        moveB = ~moveA & ~undefined & ~exact
+        a[index[moveA]] = t[moveA]
+        ga[index[moveA]] = gt[moveA]
+        b[index[moveB]] = t[moveB]
+        gb[index[moveB]] = gt[moveB]
+        newWidth = b[index] - a[index]
+        #Next point: Newton from t, false position without a derivative
+        candidate = numpy.full(len(index), numpy.nan)
+        if evalDerivative is not None:
+            dt = evalDerivative(t, values, index)
+            with numpy.errstate(all = 'ignore'):
+                candidate = t - gt / dt
+        with numpy.errstate(all = 'ignore'):
+            secant = b[index] - gb[index] * (b[index] - a[index]) / (gb[index] - ga[index])
+        candidate = numpy.where(numpy.isfinite(candidate), candidate, secant)
+        step = numpy.abs(candidate - t)
+        if evalDerivative is not None:
+            #Newton steps have to at least halve every two steps
+            bisect[index] = step > 0.5 * olderStep[index]
+        else:
+            #False position has to at least halve the bracket every step
+            bisect[index] = newWidth > 0.5 * width[index]
+        width[index] = newWidth
+        inside = (candidate > a[index]) & (candidate < b[index]) & ~bisect[index]
+        middle = 0.5 * (a[index] + b[index])
+        nextX = numpy.where(inside, candidate, middle)
+        olderStep[index] = lastStep[index]
+        lastStep[index] = numpy.abs(nextX - t)
+        scale = tolerance * (1.0 + numpy.abs(t))
+        #Done when the bracket or an accepted Newton step is below the
+        #tolerance, or the midpoint is one of the ends in floating point
+        done = (newWidth <= scale) | (middle <= a[index]) | (middle >= b[index])
+        if evalDerivative is not None:
+            done |= inside & (step <= scale)
+        done &= ~undefined & ~exact
+        finished = index[done]
+        closer = numpy.abs(ga[finished]) <= numpy.abs(gb[finished])
+        roots[finished] = numpy.where(closer, a[finished], b[finished])
+        residuals[finished] = numpy.where(closer, ga[finished], gb[finished])
+        #At a pole f - level grows as the bracket closes in on it
+        pole = ~numpy.isfinite(residuals[finished]) | (numpy.abs(residuals[finished]) > start[finished])
+        status[finished] = numpy.where(pole, POLE, CONVERGED)
+        x[index] = nextX
+        active[index] = status[index] == NOT_CONVERGED
+    unsolved = status != CONVERGED
+    roots[unsolved] = numpy.nan
+    residuals[unsolved & (status != POLE)] = numpy.nan
+    return evaluations
+
+#Solve function = level for variable where lo and hi bracket a root.
+#fixed holds the values of the other variable (an array) or, for more
+#variables, a dict of arrays by name.  level, lo, hi and the fixed values
+#broadcast against each other.  Points are solved batchSize at a time.
+#newton set to False, or a function without a derivative, uses false
+#position and bisection steps only.  Returns a Solution
+def solve(function, level, lo, hi, fixed, variable = 'y', tolerance = DEFAULT_TOLERANCE,
+        maxIterations = DEFAULT_MAX_ITERATIONS, batchSize = DEFAULT_BATCH_SIZE, newton = True):
+    requireNumpy()
+    values = fixedValues(function, variable, fixed)
+    shape, level, lo, hi, values = flattenArguments(level, lo, hi, values)
+    evalFunction, evalDerivative = makeEvaluators(function, variable, newton)
+    count = len(level)
+    roots = numpy.full(count, numpy.nan)
+    residuals = numpy.full(count, numpy.nan)
+    iterations = numpy.zeros(count, dtype = numpy.int32)
+    status = numpy.zeros(count, dtype = numpy.int8)
+    evaluations = 0
+    for start in range(0, count, batchSize):
+        end = min(start + batchSize, count)
+        batch = slice(start, end)
+        batchValues = [None if value is None else value[batch] for value in values]
+        evaluations += solveBatch(evalFunction, evalDerivative, level[batch], lo[batch], hi[batch],
+            batchValues, tolerance, maxIterations, roots[batch], residuals[batch],
+            iterations[batch], status[batch])
+    return Solution(roots.reshape(shape), residuals.reshape(shape), iterations.reshape(shape),
+        status.reshape(shape), evaluations)
+
+#Search [lo, hi] for a bracket of function = level at every point by
+#sampling samples evenly spaced values of variable, batchSize points at
+#a time.  Returns (lo, hi, found): the first pair of neighbouring samples
+#where the sign changes, or the sample that is a root as both ends.  A
+#sign change can be a pole; solve reports those
+def findBrackets(function, level, lo, hi, fixed, variable = 'y', samples = DEFAULT_SAMPLES,
+        batchSize = DEFAULT_BATCH_SIZE):
+    requireNumpy()
+    if samples < 2:
+        raise ValueError("findBrackets needs at least 2 samples")
+    values = fixedValues(function, variable, fixed)
+    shape, level, lo, hi, values = flattenArguments(level, lo, hi, values)
+    evalFunction = makeEvaluators(function, variable, False)[0]
+    count = len(level)
+    foundLo = numpy.full(count, numpy.nan)
+    foundHi = numpy.full(count, numpy.nan)
+    found = numpy.zeros(count, dtype = bool)
+    steps = numpy.linspace(0.0, 1.0, samples)
+    #Rows of samples per batch so a batch holds about batchSize values
+    rows = max(1, batchSize // samples)
+    for start in range(0, count, rows):
+        end = min(start + rows, count)
+        index = numpy.arange(start, end)
+        t = lo[index, None] + (hi[index] - lo[index])[:, None] * steps
+        repeated = numpy.repeat(index, samples)
+        g = evalFunction(t.ravel(), values, repeated).reshape(t.shape) - level[index, None]
+        zero = g == 0
+        change = (numpy.signbit(g[:, :-1]) != numpy.signbit(g[:, 1:])) & \
+            ~numpy.isnan(g[:, :-1]) & ~numpy.isnan(g[:, 1:])
+        #A root at a sample counts before a sign change after it
+        bracket = numpy.concatenate([zero[:, :-1] | change, zero[:, -1:]], axis = 1)
+        has = bracket.any(axis = 1)
+        first = bracket.argmax(axis = 1)
+        rowsFound = numpy.flatnonzero(has)
+        firstFound = first[rowsFound]
+        atSample = zero[rowsFound, firstFound]
+        foundLo[index[rowsFound]] = t[rowsFound, firstFound]
+        nextSample = numpy.minimum(firstFound + 1, samples - 1)
+        foundHi[index[rowsFound]] = numpy.where(atSample, t[rowsFound, firstFound], t[rowsFound, nextSample])
+        found[index[rowsFound]] = True
+    return (foundLo.reshape(shape), foundHi.reshape(shape), found.reshape(shape))
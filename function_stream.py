@@ -0,0 +1,160 @@
+#Streaming evaluation of a Function over large point files.
+#Points are read in chunks, evaluated as one batch per chunk and the
+#z values are written out before the next chunk is read, so memory use
+#depends on the chunk size and not on the size of the input.
+#  python function_stream.py "z=x^2+y" points.csv out.csv
+#  python function_stream.py "z=x/y" - - --format binary < in.bin > out.bin
+import argparse
+import itertools
+import sys
+import time
+from function_parser import Function, FunctionSyntaxError, requireNumpy, numpy
+
+DEFAULT_CHUNK_SIZE = 65536
+
+#Yield (xs, ys) arrays of up to chunkSize rows from a text stream of
+#"x,y" lines.  Columns after the second are ignored
+def readCsvChunks(stream, chunkSize = DEFAULT_CHUNK_SIZE, delimiter = ',', skipHeader = False):
+    requireNumpy()
+    if skipHeader:
+        stream.readline()
+    while True:
+        lines = list(itertools.islice(stream, chunkSize))
+        if len(lines) == 0:
+            return
+        rows = numpy.loadtxt(lines, delimiter = delimiter, usecols = (0, 1), ndmin = 2)
+        yield (rows[:, 0], rows[:, 1])
+
+#Yield (xs, ys) arrays of up to chunkSize rows from a binary stream of
+#interleaved x, y values of the given dtype in native byte order
+def readBinaryChunks(stream, chunkSize = DEFAULT_CHUNK_SIZE, dtype = 'float64'):
+    requireNumpy()
+    rowBytes = 2 * numpy.dtype(dtype).itemsize
+    while True:
+        data = stream.read(chunkSize * rowBytes)
+        if len(data) == 0:
+            return
+        #A short read can end in the middle of a row; finish the row
+        while len(data) % rowBytes != 0:
+            more = stream.read(rowBytes - len(data) % rowBytes)
+            if len(more) == 0:
+                raise ValueError("binary input ends in the middle of a row")
+            data += more
+        rows = numpy.frombuffer(data, dtype = dtype).reshape(-1, 2)
+        yield (rows[:, 0], rows[:, 1])
+
+#Write z values to a text stream, one per line
+def writeCsvChunk(stream, values):
+    numpy.savetxt(stream, values, fmt = '%.17g')
+
+#Write z values to a binary stream in the given dtype
+def writeBinaryChunk(stream, values, dtype = 'float64'):
+    stream.write(numpy.asarray(values, dtype = dtype).tobytes())
+
+#Evaluate function over every chunk of (xs, ys) and yield the z values
+def evalChunks(function, chunks):
+    for xs, ys in chunks:
+        yield function.evalArray(xs, ys)
+
+#Evaluates chunks of points read from one stream and writes the results to
+#another, keeping count of the rows and the time spent
+class StreamEvaluator:
+    def __init__(self, function, chunkSize = DEFAULT_CHUNK_SIZE, dtype = 'float64'):
+        requireNumpy()
+        self.__function = function
+        self.__function.ensureCompiled()
+        self.__chunkSize = chunkSize
+        self.__dtype = dtype
+        self.__rows = 0
+        self.__seconds = 0.0
+
+    #Read points from inStream in inFormat ('csv' or 'binary') and write
+    #z values to outStream in outFormat.  progress, if given, is called
+    #after every chunk with the row count and the elapsed seconds
+    def run(self, inStream, outStream, inFormat = 'csv', outFormat = 'csv',
+            delimiter = ',', skipHeader = False, progress = None):
+        if inFormat == 'csv':
+            chunks = readCsvChunks(inStream, self.__chunkSize, delimiter, skipHeader)
+        else:
+            chunks = readBinaryChunks(inStream, self.__chunkSize, self.__dtype)
+        start = time.perf_counter()
+        for values in evalChunks(self.__function, chunks):
+            if outFormat == 'csv':
+                writeCsvChunk(outStream, values)
+            else:
+                writeBinaryChunk(outStream, values, self.__dtype)
+            self.__rows += len(values)
+            self.__seconds = time.perf_counter() - start
+            if progress is not None:
+                progress(self.__rows, self.__seconds)
+        self.__seconds = time.perf_counter() - start
+        return self.__rows
+
+    def getRows(self):
+        return self.__rows
+
+    def getSeconds(self):
+        return self.__seconds
+
+    def getRowsPerSecond(self):
+        if self.__seconds == 0.0:
+            return 0.0
+        return self.__rows / self.__seconds
+
+#Open a path for the command line, '-' meaning stdin or stdout
+def openStream(path, mode, binary):
+    if path == '-':
+        if 'r' in mode:
+            stream = sys.stdin
+        else:
+            stream = sys.stdout
+        if binary:
+            return stream.buffer
+        return stream
+    if binary:
+        return open(path, mode + 'b')
+    return open(path, mode, newline = '')
+
+def main(args = None):
+    argParser = argparse.ArgumentParser(description = "Evaluate z=f(x,y) over a stream of points")
+    argParser.add_argument('function', help = "function such as z=x^2+y")
+    argParser.add_argument('input', nargs = '?', default = '-', help = "point file, - for stdin")
+    argParser.add_argument('output', nargs = '?', default = '-', help = "output file, - for stdout")
+    argParser.add_argument('--format', choices = ['csv', 'binary'], default = 'csv', help = "input format")
+    argParser.add_argument('--output-format', choices = ['csv', 'binary'], default = None,
+        help = "output format, same as the input format by default")
+    argParser.add_argument('--chunk-size', type = int, default = DEFAULT_CHUNK_SIZE, help = "rows per batch")
+    argParser.add_argument('--dtype', choices = ['float32', 'float64'], default = 'float64',
+        help = "value type of binary input and output")
+    argParser.add_argument('--delimiter', default = ',', help = "csv column separator")
+    argParser.add_argument('--skip-header', action = 'store_true', help = "skip the first csv line")
+    argParser.add_argument('--quiet', action = 'store_true', help = "do not report progress")
+    options = argParser.parse_args(args)
+    outFormat = options.output_format or options.format
+
+    def progress(rows, seconds):
+        if seconds > 0:
+            sys.stderr.write("\r%d rows, %.0f rows/s" % (rows, rows / seconds))
+
+    try:
+        function = Function(options.function)
+    except FunctionSyntaxError as error:
+        argParser.error("bad function " + repr(options.function) + ": " + str(error))
+    evaluator = StreamEvaluator(function, options.chunk_size, options.dtype)
+    inStream = openStream(options.input, 'r', options.format == 'binary')
+    outStream = openStream(options.output, 'w', outFormat == 'binary')
+    try:
+        evaluator.run(inStream, outStream, options.format, outFormat,
+            options.delimiter, options.skip_header, None if options.quiet else progress)
+    finally:
+        outStream.flush()
+        if options.input != '-':
+            inStream.close()
+        if options.output != '-':
+            outStream.close()
+    if not options.quiet:
+        sys.stderr.write("\r%d rows in %.2f s, %.0f rows/s\n" % (evaluator.getRows(),
+            evaluator.getSeconds(), evaluator.getRowsPerSecond()))
+
+if __name__ == '__main__':
+    main()
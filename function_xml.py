@@ -7,312 +7,243 @@
 #Tree node
 #  left and right children
 #  value (x, y, op, or number)
+#
+#The XML is made from the node tree of function_parser, so a line is
+#lexed and parsed once for both the XML and the Function
+import sys
+from xml.sax.saxutils import escape
+from xml.etree.ElementTree import iterparse
+import function_parser
+from function_parser import NodeTable, Function, Lexer, EOI, formatNumber
 
-class Type:    
-    def __init__(self, type, valids = []):
-        self.__type = type
-        self.__valids = valids
-    
-    #Check if a char sequence would make a valid
-    #token of this type
-    def valid(self, charSeq):
-        return charSeq in self.__valids
-    
-    def __str__(self):
-        return self.__type
-        
-    def __repr__(self):
-        return self.__str__()
+#Characters collected before the XML writer writes to its stream
+BUFFER_SIZE = 65536
 
-#Derived class for integer type
-class INT(Type):
-    def __init__(self):
-        Type.__init__(self, 'Int')
+#Buffers text and writes it to a file-like object in large chunks
+class XMLWriter:
+    def __init__(self, stream, bufferSize = BUFFER_SIZE):
+        self.__stream = stream
+        self.__bufferSize = bufferSize
+        self.__parts = []
+        self.__size = 0
 
-#Derived class for float type
-class FLOAT(Type):
-    def __init__(self):
-        Type.__init__(self, 'Float')
+    def write(self, text):
+        self.__parts.append(text)
+        self.__size += len(text)
+        if self.__size >= self.__bufferSize:
+            self.flush()
 
-#Derived class for id type             
-class ID(Type):
-    def __init__(self):
-        Type.__init__(self, 'Id', ['x', 'y', 'z'])
-        
-class ASSIGNMENT(Type):
-    def __init__(self):
-        Type.__init__(self, 'Assignment', ['='])
+    def flush(self):
+        if len(self.__parts) > 0:
+            self.__stream.write("".join(self.__parts))
+            self.__parts = []
+            self.__size = 0
 
-#Derived class for operator type        
-class OPERATOR(Type):
-    def __init__(self):
-        Type.__init__(self, 'Operator', ['+', '-', '*', '/', '^'])
+#Operators that chain left to right inside each grammar element
+EXPRESSION_OPERATORS = ['+', '-']
+TERM_OPERATORS = ['*', '/']
 
-class PARENTHESIS(Type):
-    def __init__(self):
-        Type.__init__(self, 'Parenthesis', ['(', ')'])
-        
-#Derived class for end-of-input type
-class EOI(Type):
-    def __init__(self):
-        Type.__init__(self, 'EOI', ['$'])
+def xmlTag(level, value, header):
+    tail = ""
+    if not header:
+        tail += "/"
+    return ('\t' * level) + "<" + tail + value + ">\n"
 
-#Derived class for invalid type        
-class Invalid(Type):
-    def __init__(self):
-        Type.__init__(self, 'Invalid')
+#XML line of one token, the text escaped
+def xmlToken(level, tokenType, text):
+    return ('\t' * level) + "<" + tokenType + ">" + escape(text) + "</" + tokenType + ">\n"
 
-#Token class that stores a token type object
-#and the value of the token        
-class Token:
-    def __init__(self, type, val):
-        self.__type = type
-        self.__val = val
-        
-    def getType(self):
-        return self.__type
-    
-    def getVal(self):
-        return self.__val
-    
-    def __str__(self):
-        header = "<" + str(self.__type) + ">"
-        footer = "</" + str(self.__type) + ">"
-        return header + self.__val + footer
-    
-    def __repr__(self):
-        return self.__str__()
+#Operands of a left associative chain of the given operators, as the
+#first operand and a list of (operator, operand) pairs
+def splitChain(node, operators):
+    rest = []
+    while node.getLeft() is not None and node.getVal() in operators:
+        rest.append((node.getVal(), node.getRight()))
+        node = node.getLeft()
+    rest.reverse()
+    return node, rest
 
-#Class that performs lexical analysis
-#by turning a character sequence to a token sequence        
-class Lexer:
-    def __init__(self, s):
-        self.__s = s
-        self.__len = len(s)
-        self.__index = 0
-        self.__eoi = False
-        self.__singleCharTypes = [
-            ASSIGNMENT(),
-            OPERATOR(),
-            PARENTHESIS(),
-            EOI()
-        ]
-    
-    #Get current char in stream    
-    def __getCurrentChar(self):
-        return self.__s[self.__index]
-    
-    #Is current character a letter?    
-    def __isCharLetter(self):
-        if self.__endStream():
-            return False
-        curChar = self.__getCurrentChar()
-        return ('A' <= curChar <= 'Z') or ('a' <= curChar <= 'z')
-    
-    #Is current character a digit?
-    def __isCharDigit(self):
-        if self.__endStream():
-            return False
-        curChar = self.__getCurrentChar()
-        return '0' <= curChar <= '9'
-    
-    #Is current character a space?    
-    def __isCharSpace(self):
-        return self.__getCurrentChar() == ' '
-    
-    #Did we reach the end of the character stream?
-    def __endStream(self):
-        return self.__index >= self.__len
-    
-    #Go to next character in the stream
-    def __toNextChar(self):
-        self.__index += 1
-   
-    #Get a sequence of digits
-    def __getNumber(self):
-        result = ''
-        while (self.__isCharDigit()):
-            result += self.__getCurrentChar()
-            self.__toNextChar()
-        return result
-    
-    #Get a sequence of letters and digits
-    def __getAlphaNum(self):
-        result = ''
-        while (self.__isCharLetter() or self.__isCharDigit()):
-            result += self.__getCurrentChar()
-            self.__toNextChar()
-        return result
-        
-    #Get next token from character stream
-    def nextToken(self):
-        while not self.__endStream():
-            
-            #Check if character is operator, comma, or EOI
-            current = self.__getCurrentChar()
-            for tokenType in self.__singleCharTypes:
-                if tokenType.valid(current): 
-                    if isinstance(tokenType, EOI):
-                        self.__eoi = True
-                    self.__toNextChar()
-                    return Token(tokenType, current)
-            
-            #Get an integer or float if
-            #character is a digit
-            if self.__isCharDigit():
-                leftDigits = self.__getNumber()
-                current = self.__getCurrentChar()
-                if (current == '.'):
-                    leftDigits += current
-                    self.__toNextChar()
-                    if self.__isCharDigit():
-                        rightDigits = self.__getNumber()
-                        floatStr = leftDigits + rightDigits
-                        return Token(FLOAT(), floatStr)
-                    else:
-                        return Token(Invalid(), leftDigits)
-                else:
-                    return Token(INT(), leftDigits)
-            #Get an identifier or keyword
-            #if character is a letter
-            elif self.__isCharLetter():
-                charSeq = self.__getCurrentChar()
-                self.__toNextChar()
-                return Token(ID(), charSeq)
-            #Skip to next character if it is a space
-            elif self.__isCharSpace():
-                self.__toNextChar()
-            #Mark the character as invalid if it doesn't match
-            #any of the above
+#Tree for a number the grammar has no single token for (a negative
+#number, inf or nan), parsed from the text formatNumber writes for it,
+#like "(0-1.5)" or "(1/0)".  None for numbers written as one token
+def numberTree(val):
+    valType = type(val)
+    if valType != int and valType != float:
+        return None
+    text = formatNumber(val)
+    if not text.startswith('('):
+        return None
+    return function_parser.Parser("z=" + text).getRoot()
+
+#Generate the XML lines of the tree under root in the shape of the grammar
+#  expression = term (('+' | '-') term)*
+#  term       = factor (('*' | '/') factor)*
+#  factor     = pow ['^' factor]
+#  pow        = [name] '(' expression ')' | value
+#Implicit products come out with an explicit '*' and only the parentheses
+#the tree needs are written.  Negative and non-finite numbers are written
+#as the expression formatNumber gives them, so loadXML reads them back as
+#that expression, with the same value.  An explicit stack of pending elements and
+#lines is used, so deep trees do not grow the Python stack
+def iterTreeXML(root):
+    yield "<Function>\n"
+    yield xmlToken(1, 'Id', 'z')
+    yield xmlToken(1, 'Assignment', '=')
+    stack = [('Expression', root, 1)]
+    while stack:
+        item = stack.pop()
+        if type(item) == str:
+            yield item
+            continue
+        tag, node, level = item
+        val = node.getVal()
+        isOperator = node.getLeft() is not None
+        parts = [xmlTag(level, tag, True)]
+        if tag == 'Expression' or tag == 'Term':
+            if tag == 'Expression':
+                operators, inner = EXPRESSION_OPERATORS, 'Term'
+            else:
+                operators, inner = TERM_OPERATORS, 'Factor'
+            first, rest = splitChain(node, operators)
+            parts.append((inner, first, level + 1))
+            for op, operand in rest:
+                parts.append(xmlToken(level + 1, 'Operator', op))
+                parts.append((inner, operand, level + 1))
+        elif tag == 'Factor':
+            if isOperator and val == '^':
+                parts.append(('Power', node.getLeft(), level + 1))
+                parts.append(xmlToken(level + 1, 'Operator', '^'))
+                parts.append(('Factor', node.getRight(), level + 1))
             else:
-                current = self.__getCurrentChar()
-                self.__toNextChar()
-                return Token(Invalid(), current)
-        #Make an invalid token if eoi is not reached by
-        #the end of the character stream
-        if not self.__eoi:
-            return Token(Invalid(), '')
+                parts.append(('Power', node, level + 1))
+        elif tag == 'Power':
+            if isOperator and node.getRight() is None:
+                parts.append(xmlToken(level + 1, 'FunctionName', val))
+                parts.append(xmlToken(level + 1, 'Parenthesis', '('))
+                parts.append(('Expression', node.getLeft(), level + 1))
+                parts.append(xmlToken(level + 1, 'Parenthesis', ')'))
+            elif isOperator or numberTree(val) is not None:
+                if not isOperator:
+                    node = numberTree(val)
+                parts.append(xmlToken(level + 1, 'Parenthesis', '('))
+                parts.append(('Expression', node, level + 1))
+                parts.append(xmlToken(level + 1, 'Parenthesis', ')'))
+            else:
+                parts.append(('Value', node, level + 1))
+        elif type(val) == int:
+            parts.append(xmlToken(level + 1, 'Int', str(val)))
+        elif type(val) == float:
+            parts.append(xmlToken(level + 1, 'Float', formatNumber(val)))
         else:
-            return None
+            parts.append(xmlToken(level + 1, 'Id', val))
+        parts.append(xmlTag(level, tag, False))
+        parts.reverse()
+        stack.extend(parts)
+    yield "</Function>\n"
 
-#SQL SELECT command parser class
+#Writes the abstract syntax tree of a function as XML.  The line is
+#parsed once by function_parser; root can be given instead of parsing.
+#variables are the names the function takes, x and y by default
 class Parser:
-    #Take an inpuuted line and append $ for EOI
-    def __init__(self, s):
-        self.__lexer = Lexer(s + "$")
-        self.__token = self.__lexer.nextToken()
-        
-    def __printXML(self, level, value, header):
-        tail = ""
-        if not header:
-            tail += "/"
-        print(('\t' * level) + "<" + tail + value + ">")
-    
-    #Store the next token outputted by the lexer into the private member
-    def __getNextToken(self):
-        self.__token = self.__lexer.nextToken()
-        
-    def __matchesVals(self, tokenType, values = []):
-        if len(values) > 0:
-            for val in values:
-                if (self.__matches(tokenType, val)):
-                    return True
-            return False
-        else:
-            return self.__matches(tokenType)
-            
-    
-    #Check if the current token matches the inputted token type
-    #and if length of keyword > 0, then check if token is a keyword type
-    #that matches the inputted keyword arg
-    def __matches(self, tokenType, value = ""):
-        validValue = True
-        if (len(value) > 0):
-            validValue = self.__token.getVal() == value
-        return validValue and isinstance(self.__token.getType(), tokenType)
-    
-    #Print out the error by showing what type of token the parser was expecting
-    #vs what it saw.  Then, exit so the parser doesn't keep parsing after syntax error.
-    def __printError(self, tokenType):
-        tokenTypeObj = tokenType()
-        print("Syntax error: expecting " + str(tokenTypeObj) + "; saw " + str(self.__token.getType()) + '\n')
-        exit()
-    
-    #Check if the token matches the type inputted and print it out if it does.
-    #Otherwise, print the syntax error message and exit.  If keyword has length > 0
-    #make sure the token matches the keyword inputted
-    def __checkAndPrintToken(self, level, tokenType, keyword = ""):
-        if (self.__matches(tokenType, keyword)):
-            print(('\t' * level) + str(self.__token))
-            self.__getNextToken()
-        else:
-            self.__printError(tokenType)
-            
-    def __expression(self, level):
-        self.__printXML(level, "Expression", True)
-        self.__term(level + 1)
-        while self.__matchesVals(OPERATOR, ['+', '-']):
-            self.__checkAndPrintToken(level + 1, OPERATOR)
-            self.__term(level + 1)
-        self.__printXML(level, "Expression", False)
-            
-    def __term(self, level):
-        self.__printXML(level, "Term", True)
-        self.__factor(level + 1)
-        while not (self.__matchesVals(OPERATOR, ['+','-']) 
-            or self.__matches(PARENTHESIS) or self.__matches(EOI)):
-            if (self.__matches(OPERATOR)):
-                self.__checkAndPrintToken(level + 1, OPERATOR)
-            self.__factor(level + 1)
-        self.__printXML(level, "Term", False)
-            
-    def __factor(self, level):
-        self.__printXML(level, "Factor", True)
-        self.__pow(level + 1)
-        if self.__matches(OPERATOR, "^"):
-            self.__checkAndPrintToken(level + 1, OPERATOR)
-            self.__factor(level + 1)
-        self.__printXML(level, "Factor", False)
-        
-    def __pow(self, level):
-        self.__printXML(level, "Power", True)
-        if self.__matches(PARENTHESIS, '('):
-            self.__checkAndPrintToken(level + 1, PARENTHESIS)
-            self.__expression(level + 1)
-            self.__checkAndPrintToken(level + 1, PARENTHESIS)
-        else:
-            self.__value(level + 1)
-        self.__printXML(level, "Power", False)
-        
-    def __value(self, level):
-        self.__printXML(level, "Value", True)
-        if self.__matchesVals(ID, ['x', 'y']):            
-            self.__checkAndPrintToken(level + 1, ID)
-        elif self.__matches(FLOAT):
-            self.__checkAndPrintToken(level + 1, FLOAT)
-        else:
-            self.__checkAndPrintToken(level + 1, INT)
-        self.__printXML(level, "Value", False)
-            
-    
-    #Print out SQL command line into an abstract syntax tree
-    #in XML format
-    def run(self):
-        print("<Function>")
-        self.__checkAndPrintToken(1, ID, 'z')
-        self.__checkAndPrintToken(1, ASSIGNMENT) 
-        self.__expression(1)
-        if (self.__matches(EOI)):
-            print("</Function>")
+    def __init__(self, s, root = None, variables = None):
+        self.__source = s
+        self.__variables = variables
+        if root is None:
+            root = function_parser.Parser(s, None, variables).getRoot()
+        self.__root = root
+
+    def getRoot(self):
+        return self.__root
+
+    #Function of the same parse, without lexing or parsing again
+    def getFunction(self, optimize = True):
+        return Function(self.__source, optimize, self.__root, self.__variables)
+
+    #Generate the abstract syntax tree in XML format
+    #one line at a time
+    def iterXML(self):
+        return iterTreeXML(self.__root)
+
+    #Write the abstract syntax tree in XML format to stream
+    #(stdout by default) through a buffered writer
+    def run(self, stream = None):
+        if stream is None:
+            stream = sys.stdout
+        writer = XMLWriter(stream)
+        for line in self.iterXML():
+            writer.write(line)
+        writer.flush()
+
+#Tags of the XML elements that hold a single token
+TOKEN_TAGS = ['Id', 'Int', 'Float', 'Operator', 'Parenthesis', 'Assignment', 'FunctionName']
+
+#Node of a function_parser tree for one finished grammar element,
+#given the results of its child elements.  Tokens are ('token', tag, text)
+def buildElement(tag, children, nodes):
+    if tag in TOKEN_TAGS:
+        return ('token', tag, children)
+    parts = [child for child in children if not (type(child) == tuple and child[1] == 'Parenthesis')]
+    if tag == 'Value':
+        token = parts[0]
+        if token[1] == 'Int':
+            return nodes.getNode(int(token[2]))
+        elif token[1] == 'Float':
+            return nodes.getNode(float(token[2]))
+        return nodes.getNode(token[2])
+    elif tag == 'Power':
+        #[FunctionName] Expression or a Value
+        if len(parts) == 2:
+            return nodes.getNode(parts[0][2], parts[1])
+        return parts[0]
+    elif tag == 'Factor':
+        #Power ['^' Factor], right associative
+        if len(parts) == 3:
+            return nodes.getNode('^', parts[0], parts[2])
+        return parts[0]
+    elif tag == 'Expression' or tag == 'Term':
+        #Left associative chain, a Term without an operator multiplies
+        node = parts[0]
+        op = '*'
+        for part in parts[1:]:
+            if type(part) == tuple:
+                op = part[2]
+            else:
+                node = nodes.getNode(op, node, part)
+                op = '*'
+        return node
+    elif tag == 'Function':
+        return parts[-1]
+    raise ValueError("unknown element <" + tag + ">")
+
+#Rebuild the function_parser node tree from XML written by Parser.run.
+#source is a file name or a file-like object.  The XML is read as a
+#stream of elements with an explicit stack, so deep trees are fine
+def loadXML(source, nodes = None):
+    if nodes is None:
+        nodes = NodeTable()
+    stack = [[]]
+    for event, element in iterparse(source, events = ('start', 'end')):
+        if event == 'start':
+            stack.append([])
         else:
-            self.__printError(EOI)
-            
-a = Lexer("z=x^2+2y" + "$")
-b = a.nextToken()
-while not isinstance(b.getType(), EOI):
-    print(b)
+            children = stack.pop()
+            if element.tag in TOKEN_TAGS:
+                children = element.text or ""
+            stack[-1].append(buildElement(element.tag, children, nodes))
+            element.clear()
+    return stack[0][0]
+
+#Function for XML written by Parser.run, of the variables the
+#function was written with
+def loadFunction(source, optimize = True, variables = None):
+    return Function(None, optimize, loadXML(source), variables)
+
+if __name__ == '__main__':
+    a = Lexer("z=x^2+2y" + "$")
     b = a.nextToken()
-    
-c = Parser("z=3x^y^4-2y^3+3.2/(xy^7)")
-c.run()
-        
\ No newline at end of file
+    while not isinstance(b.getType(), EOI):
+        print(b)
+        b = a.nextToken()
+        
+    c = Parser("z=3x^y^4-2y^3+3.2/(xy^7)")
+    c.run()
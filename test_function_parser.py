@@ -0,0 +1,338 @@
+#Tests of the lexer, parser and optimizer.  The token streams and trees
+#are checked against a transcription of the original character lexer and
+#recursive descent parser, which the table driven lexer and the operator
+#precedence parser replaced.  Run with
+#  python -m unittest test_function_parser
+#  python -m pytest test_function_parser.py
+import asyncio
+import cmath
+import json
+import random
+import unittest
+from function_parser import (Function, Lexer, Parser, FunctionSyntaxError, EOI,
+    countNodes, numpy)
+
+#Token types of the single characters of the original lexer
+REFERENCE_CHAR_TYPES = {'=' : 'Assignment', '+' : 'Operator', '-' : 'Operator',
+    '*' : 'Operator', '/' : 'Operator', '^' : 'Operator', '(' : 'Parenthesis',
+    ')' : 'Parenthesis', '$' : 'EOI'}
+
+def isReferenceDigit(char):
+    return '0' <= char <= '9'
+
+#(type, text) tokens of s up to and including EOI, the way the original
+#character by character lexer made them
+def referenceTokens(s):
+    s += "$"
+    tokens = []
+    i = 0
+    while True:
+        char = s[i]
+        if char in REFERENCE_CHAR_TYPES:
+            tokens.append((REFERENCE_CHAR_TYPES[char], char))
+            i += 1
+            if char == '$':
+                return tokens
+        elif isReferenceDigit(char):
+            end = i
+            while isReferenceDigit(s[end]):
+                end += 1
+            if s[end] == '.':
+                fraction = end + 1
+                while isReferenceDigit(s[fraction]):
+                    fraction += 1
+                if fraction > end + 1:
+                    tokens.append(('Float', s[i:fraction]))
+                else:
+                    tokens.append(('Invalid', s[i:fraction]))
+                i = fraction
+            else:
+                tokens.append(('Int', s[i:end]))
+                i = end
+        elif 'a' <= char <= 'z' or 'A' <= char <= 'Z':
+            tokens.append(('Id', char))
+            i += 1
+        elif char == ' ':
+            i += 1
+        else:
+            tokens.append(('Invalid', char))
+            i += 1
+
+#(type, text) tokens of s from the lexer, up to and including EOI
+def lexerTokens(s):
+    lexer = Lexer(s + "$")
+    tokens = []
+    while True:
+        token = lexer.nextToken()
+        tokens.append((str(token.getType()), token.getVal()))
+        if isinstance(token.getType(), EOI):
+            return tokens
+
+#Syntax error of the original parser, which printed it and exited
+class ReferenceSyntaxError(Exception):
+    def __init__(self, expected, saw):
+        Exception.__init__(self, expected, saw)
+        self.expected = expected
+        self.saw = saw
+
+#The original recursive descent grammar over referenceTokens.  Trees are
+#nested tuples: (op, left, right), a variable name or (type, number)
+class ReferenceParser:
+    def __init__(self, s):
+        self.__tokens = referenceTokens(s)
+        self.__index = 0
+
+    def __matches(self, tokenType, value = None):
+        token = self.__tokens[self.__index]
+        return token[0] == tokenType and (value is None or token[1] == value)
+
+    def __take(self, tokenType, value = None):
+        if not self.__matches(tokenType, value):
+            raise ReferenceSyntaxError(tokenType, self.__tokens[self.__index][0])
+        self.__index += 1
+        return self.__tokens[self.__index - 1][1]
+
+    #Tree of the line.  The original parser stopped after the expression,
+    #so the type of the token it stopped at is returned too
+    def getRoot(self):
+        self.__take('Id', 'z')
+        self.__take('Assignment')
+        root = self.__expression()
+        return (root, self.__tokens[self.__index][0])
+
+    def __expression(self):
+        node = self.__term()
+        while self.__matches('Operator', '+') or self.__matches('Operator', '-'):
+            node = (self.__take('Operator'), node, self.__term())
+        return node
+
+    def __term(self):
+        node = self.__factor()
+        while not (self.__matches('Operator', '+') or self.__matches('Operator', '-')
+                or self.__matches('Parenthesis', ')') or self.__matches('EOI')):
+            op = '*'
+            if self.__matches('Operator'):
+                op = self.__take('Operator')
+            node = (op, node, self.__factor())
+        return node
+
+    def __factor(self):
+        node = self.__pow()
+        if self.__matches('Operator', '^'):
+            self.__take('Operator')
+            node = ('^', node, self.__factor())
+        return node
+
+    def __pow(self):
+        if self.__matches('Parenthesis', '('):
+            self.__take('Parenthesis')
+            node = self.__expression()
+            self.__take('Parenthesis', ')')
+            return node
+        if self.__matches('Id', 'x') or self.__matches('Id', 'y'):
+            return self.__take('Id')
+        if self.__matches('Float'):
+            return ('float', float(self.__take('Float')))
+        return ('int', int(self.__take('Int')))
+
+#Node tree as the nested tuples of ReferenceParser
+def treeTuple(node):
+    val = node.getVal()
+    if type(val) == int or type(val) == float:
+        return (type(val).__name__, val)
+    if node.getLeft() is None:
+        return val
+    return (val, treeTuple(node.getLeft()), treeTuple(node.getRight()))
+
+#('tree', tuple) or ('error', expected, saw) for s, from the parser
+def parseResult(s):
+    try:
+        return ('tree', treeTuple(Parser(s).getRoot()))
+    except FunctionSyntaxError as error:
+        return ('error', error.getExpected(), error.getSaw())
+
+#The same for the original parser.  Input left after the expression is
+#an error expecting EOI, as function_xml reported it
+def referenceResult(s):
+    try:
+        root, stop = ReferenceParser(s).getRoot()
+    except ReferenceSyntaxError as error:
+        return ('error', error.expected, error.saw)
+    if stop != 'EOI':
+        return ('error', 'EOI', stop)
+    return ('tree', root)
+
+#Random text over alphabet of up to maxLength characters
+def randomText(rand, alphabet, maxLength):
+    return "".join(rand.choice(alphabet) for i in range(rand.randint(0, maxLength)))
+
+#Random well formed expression text.  Exponents stay small so integer
+#powers of constants stay cheap to evaluate without the optimizer
+def randomExpression(rand, depth, functions = True):
+    if depth == 0 or rand.random() < 0.25:
+        return rand.choice(['x', 'y', str(rand.randint(0, 12)), rand.choice(['0.5', '2.25', '3.0'])])
+    left = randomExpression(rand, depth - 1, functions)
+    kind = rand.randrange(6)
+    if kind == 0:
+        return "(" + left + ")^" + rand.choice(['0', '1', '2', '3', '0.5', 'x', 'y', '(y-1)'])
+    elif kind == 1:
+        return rand.choice(['2', 'x', 'y']) + "(" + left + ")"
+    elif kind == 2 and functions:
+        return rand.choice(['sin', 'cos', 'exp', 'log', 'sqrt']) + "(" + left + ")"
+    right = randomExpression(rand, depth - 1, functions)
+    if rand.random() < 0.5:
+        right = "(" + right + ")"
+    return left + rand.choice(['+', '-', '*', '/']) + right
+
+#Are two scalar results the same, up to rounding?  Exceptions are the
+#same when they have the same type
+def sameScalar(a, b):
+    if isinstance(a, Exception) or isinstance(b, Exception):
+        return type(a) == type(b)
+    if cmath.isnan(a) or cmath.isnan(b):
+        return cmath.isnan(a) and cmath.isnan(b)
+    if cmath.isinf(a) or cmath.isinf(b):
+        return a == b
+    return cmath.isclose(a, b, rel_tol = 1e-9, abs_tol = 1e-12)
+
+#Value of function at a point, or the exception it raised
+def scalarResult(function, x, y):
+    try:
+        return function.eval(x, y)
+    except (ArithmeticError, ValueError) as error:
+        return error
+
+POINTS = [(0.0, 0.0), (1.0, 1.0), (-1.5, 2.0), (2.5, -0.75), (1e-3, 7.0)]
+
+class LexerTest(unittest.TestCase):
+    def testFixedTokens(self):
+        for s in ["z=x^2+2y", "z=3x^y^4-2y^3+3.2/(xy^7)", "z = 3. + x", "z=1.5.2", "z=ab#1", ""]:
+            self.assertEqual(lexerTokens(s), referenceTokens(s), s)
+
+    def testRandomTokens(self):
+        rand = random.Random(1)
+        for i in range(5000):
+            s = randomText(rand, "xyzab0123456789.+-*/^()= #\t", 14)
+            self.assertEqual(lexerTokens(s), referenceTokens(s), s)
+
+class ParserTest(unittest.TestCase):
+    def testRandomExpressions(self):
+        rand = random.Random(2)
+        for i in range(2000):
+            s = "z=" + randomExpression(rand, 4, False)
+            self.assertEqual(parseResult(s), referenceResult(s), s)
+            self.assertEqual(parseResult(s)[0], 'tree', s)
+
+    def testRandomText(self):
+        rand = random.Random(3)
+        for i in range(5000):
+            s = rand.choice(["z=", ""]) + randomText(rand, "xyz0123456789.+-*/^()= ", 12)
+            self.assertEqual(parseResult(s), referenceResult(s), s)
+
+    def testTrailingInput(self):
+        for s in ["z=x)+3", "z=x)garbage", "z=(x+1))"]:
+            self.assertEqual(parseResult(s), ('error', 'EOI', 'Parenthesis'), s)
+
+class OptimizerTest(unittest.TestCase):
+    def assertSameFunctions(self, source):
+        plain = Function(source, False)
+        optimized = Function(source)
+        compiled = Function(source)
+        compiled.compile()
+        for x, y in POINTS:
+            expected = scalarResult(plain, x, y)
+            for function in (optimized, compiled):
+                actual = scalarResult(function, x, y)
+                self.assertTrue(sameScalar(expected, actual),
+                    "%s at (%r, %r): %r != %r" % (source, x, y, expected, actual))
+        if numpy is None:
+            return
+        xs = numpy.array([x for x, y in POINTS])
+        ys = numpy.array([y for x, y in POINTS])
+        expected = plain.evalArray(xs, ys)
+        for function in (optimized, compiled):
+            actual = function.evalArray(xs, ys)
+            self.assertTrue(numpy.allclose(expected, actual, rtol = 1e-9, atol = 1e-12, equal_nan = True),
+                "%s: %r != %r" % (source, expected, actual))
+
+    def testRandomExpressions(self):
+        rand = random.Random(4)
+        for i in range(500):
+            self.assertSameFunctions("z=" + randomExpression(rand, 4))
+
+    def testFolds(self):
+        for source in ["z=x+2^1100", "z=x+102^210", "z=x+2^1000", "z=2x3y",
+                "z=(0-8)^(1/3)*x", "z=x^0+y*1-0", "z=0^(0-1)+x", "z=log(0)*x+sqrt(0-1)"]:
+            self.assertSameFunctions(source)
+
+    #Integer powers too wide for a float stay unfolded and overflow to
+    #inf in float64.  9^9^9 would take long to evaluate as a Python int,
+    #so it is only evaluated over arrays
+    @unittest.skipIf(numpy is None, "numpy is not installed")
+    def testWideIntegerPowers(self):
+        for source in ["z=x+2^1100", "z=x+102^210", "z=x*9^9^9"]:
+            for function in (Function(source, False), Function(source)):
+                values = function.evalArray(numpy.array([1.0, 2.0]), 0.0)
+                self.assertEqual(values.tolist(), [float('inf')] * 2, source)
+
+class LargeInputTest(unittest.TestCase):
+    def testWideExpression(self):
+        count = 25000
+        source = "z=" + "+".join("%d*x-y" % i for i in range(1, count + 1))
+        plain = Function(source, False)
+        self.assertGreaterEqual(countNodes(plain.getRoot()), 100000)
+        expected = count * (count + 1) / 2 * 1.5 - count * 0.5
+        optimized = Function(source)
+        for function in (plain, optimized):
+            self.assertAlmostEqual(function.eval(1.5, 0.5), expected, delta = 1e-6 * expected)
+        if numpy is not None:
+            values = optimized.evalArray(numpy.array([1.5, 1.5]), 0.5)
+            self.assertTrue(numpy.allclose(values, expected))
+
+    def testDeepPowerChain(self):
+        source = "z=" + "^".join(["x"] * 100000)
+        function = Function(source)
+        self.assertEqual(countNodes(function.getRoot()), 100000)
+        self.assertEqual(function.eval(1.0, 0.0), 1.0)
+        if numpy is not None:
+            self.assertEqual(function.evalArray(numpy.array([1.0, 1.0]), 0.0).tolist(), [1.0, 1.0])
+
+    def testDeepParentheses(self):
+        source = "z=" + "(" * 100000 + "x+1" + ")" * 100000 + "*y"
+        self.assertEqual(Function(source).eval(2.0, 3.0), 9.0)
+        with self.assertRaises(FunctionSyntaxError):
+            Function("z=" + "(" * 100000 + "x")
+
+class ServerTest(unittest.TestCase):
+    #Responses of a server on a free port to the request lines
+    def respond(self, requests):
+        from function_server import FunctionServer
+
+        async def run():
+            server = FunctionServer(port = 0)
+            await server.start()
+            reader, writer = await asyncio.open_connection('127.0.0.1', server.getPort())
+            responses = []
+            for request in requests:
+                writer.write(json.dumps(request).encode('utf-8') + b'\n')
+                await writer.drain()
+                responses.append(json.loads(await reader.readline()))
+            writer.close()
+            await server.close()
+            return responses
+
+        return asyncio.run(run())
+
+    def testSyntaxErrors(self):
+        responses = self.respond([
+            {'id' : 1, 'function' : "z=x)garbage", 'x' : 1, 'y' : 2},
+            {'id' : 2, 'function' : "z=x+", 'x' : 1, 'y' : 2},
+            {'id' : 3, 'function' : "z=x+y", 'x' : 1, 'y' : 2}
+        ])
+        self.assertEqual(responses[0]['error']['type'], 'syntax')
+        self.assertEqual((responses[0]['error']['expected'], responses[0]['error']['saw']), ('EOI', 'Parenthesis'))
+        self.assertEqual((responses[1]['error']['expected'], responses[1]['error']['saw']), ('Int', 'EOI'))
+        self.assertEqual(responses[2], {'id' : 3, 'z' : 3.0})
+
+if __name__ == '__main__':
+    unittest.main()